@@ -2,61 +2,363 @@
 # Email: a.huraira@innopolis.university
 
 import argparse
+import bisect
+import hashlib
+import json
+import math
+import mmap
 import os
 import socket
+import struct
+import time
+import zlib
+from threading import Thread
 
+SERVER_BUFFER = 20480
 MSS = 20476  # MSS = Server buffer size (20480) - data header size (4)
+# Windowed ACK header: type (b"A" / b"N" / b"E"), transfer id, cumulative ACK (ACK), corrupted seqno (NACK)
+# or 0 (E, the start packet was rejected).
+# ACKs are followed by the selectively acknowledged seqnos, one SACK_ENTRY each.
+WINDOW_HEADER = struct.Struct("!cIQ")
+# Windowed data header: type (b"D"), transfer id, seqno, CRC-32 of the header (with the CRC field zeroed)
+# and the payload, so a corrupted seqno or transfer id is caught like a corrupted payload
+DATA_HEADER = struct.Struct("!cIQI")
+CRC_OFFSET = 13  # position of the CRC field in DATA_HEADER
+SACK_ENTRY = struct.Struct("!Q")
+WINDOW_MSS = 20463  # Server buffer size (20480) - windowed data header size (17)
+SESSION_TIMEOUT = 30  # seconds of silence after which a session is evicted
+SWEEP_INTERVAL = 1  # how often idle sessions are looked for
 
-def receive_file(s, file_name, file_size):
-    with open(file_name, "wb") as f:
-        bytes_received = 0
-        seqno = 1
-        while bytes_received < file_size:
-            try:
-                data, addr = s.recvfrom(MSS + 4)
-                message_type = data[0:1].decode()
-                message_seqno = int(data[2:3].decode())
-                if message_type != "d" or message_seqno != seqno:
-                    raise ValueError("Invalid message")
-                f.write(data[4:])
-                bytes_received += len(data[4:])
-                print(f"Server: Received chunk {seqno}")
-                ack = f"a|{(seqno + 1) % 2}".encode()
-                s.sendto(ack, addr)
-                seqno = (seqno + 1) % 2
-            except ValueError:
-                print("Server: Invalid message received")
-                break
 
-        if bytes_received == file_size:
-            print(f"Server: File {file_name} received successfully")
+class StopAndWaitSession:
+    # One stop-and-wait upload (1-bit seqno). There is no transfer id on the wire,
+    # so it is keyed by (client address, 0).
+    def __init__(self, file_name, file_size):
+        self.file_name = file_name
+        self.file_size = file_size
+        self.file = open(file_name, "wb")
+        self.bytes_received = 0
+        self.seqno = 1
+        self.last_active = time.monotonic()
+
+    def start_ack(self):
+        return b"a|1"
+
+    def is_complete(self):
+        return self.bytes_received == self.file_size
+
+    def on_data(self, data):
+        message_seqno = data[2] - ord("0")
+        if message_seqno == self.seqno and not self.is_complete():
+            self.file.write(data[4:])
+            self.bytes_received += len(data) - 4
+            print(f"Server: Received chunk {self.seqno} of {self.file_name}")
+            self.seqno = (self.seqno + 1) % 2
+            if self.is_complete():
+                self.finish()
+        # A duplicate means our ACK was lost, so it is acknowledged again without being written
+        return f"a|{(message_seqno + 1) % 2}".encode()
+
+    def finish(self):
+        if self.file.closed:
+            return
+        self.file.close()
+        if self.is_complete():
+            print(f"Server: File {self.file_name} received successfully")
         else:
-            print(f"Server: File {file_name} transfer incomplete")
+            print(f"Server: File {self.file_name} transfer incomplete")
+
+
+def add_range(held, start, end):
+    # `held` is a sorted list of disjoint [start, end) ranges, the new range is merged into it
+    i = bisect.bisect_left(held, [start, start])
+    if i > 0 and held[i - 1][1] >= start:
+        i -= 1
+    j = i
+    while j < len(held) and held[j][0] <= end:
+        start = min(start, held[j][0])
+        end = max(end, held[j][1])
+        j += 1
+    held[i:j] = [[start, end]]
+
+
+def load_held_ranges(file_name, file_size):
+    # Byte ranges of `file_name` received by an earlier, interrupted upload
+    try:
+        with open(f"{file_name}.ranges") as f:
+            state = json.load(f)
+        if state["file_size"] == file_size and os.path.getsize(file_name) == file_size:
+            return state["held"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return []
+
+
+class ReceivedFile:
+    # A file assembled by one or more windowed transfers (stripes), possibly running in parallel.
+    # Chunks are written at their offsets with os.pwrite into the preallocated file. The byte ranges
+    # held so far are saved to {file_name}.ranges while the file is incomplete, so a later upload
+    # can resume from them.
+    def __init__(self, file_name, file_size):
+        self.file_name = file_name
+        self.file_size = file_size
+        self.held = load_held_ranges(file_name, file_size)
+        self.fd = os.open(file_name, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self.fd).st_size != file_size:
+            os.ftruncate(self.fd, file_size)
+        if file_size > 0 and hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(self.fd, 0, file_size)
+        self.sessions = 0
+
+    def write_at(self, offset, data):
+        os.pwrite(self.fd, data, offset)
+        add_range(self.held, offset, offset + len(data))
+
+    def is_complete(self):
+        return self.file_size == 0 or self.held == [[0, self.file_size]]
+
+    def close(self):
+        os.close(self.fd)
+        if self.is_complete():
+            if os.path.exists(f"{self.file_name}.ranges"):
+                os.remove(f"{self.file_name}.ranges")
+            print(f"Server: File {self.file_name} received successfully")
+        else:
+            with open(f"{self.file_name}.ranges", "w") as f:
+                json.dump({"file_size": self.file_size, "held": self.held}, f)
+            print(f"Server: File {self.file_name} transfer incomplete, {len(self.held)} ranges kept for resume")
+
+
+def held_ranges_reply(files, data):
+    # Resume handshake: r|{transfer_id}|{file_name}|{file_size} -> h|{transfer_id}|{start}-{end},...
+    _, transfer_id, file_name, file_size = bytes(data).decode().split("|")
+    file = files.get(file_name)
+    held = file.held if file is not None else load_held_ranges(file_name, int(file_size))
+    return f"h|{transfer_id}|{','.join(f'{start}-{end}' for start, end in held)}".encode()
+
+
+class WindowedSession:
+    # One Go-Back-N / Selective Repeat upload of the stripe [offset, offset + length) of a file.
+    # Chunks inside [expected, expected + window) are written to their offset as soon as they
+    # arrive. Every data packet is answered with a cumulative ACK (next expected seqno) and the list
+    # of out-of-order seqnos already held (selective ACK), so the client can retransmit only the holes.
+    def __init__(self, files, transfer_id, file_name, file_size, window, offset, length):
+        self.files = files
+        self.transfer_id = transfer_id
+        self.file_name = file_name
+        self.window = window
+        self.offset = offset
+        self.chunk_count = math.ceil(length / WINDOW_MSS)
+        if file_name not in files:
+            files[file_name] = ReceivedFile(file_name, file_size)
+        self.file = files[file_name]
+        self.file.sessions += 1
+        self.finished = False
+        self.expected = 0
+        self.received = set()  # seqnos above `expected` already written
+        self.ack = bytearray(WINDOW_HEADER.size + SACK_ENTRY.size * window)
+        self.last_active = time.monotonic()
+
+    def start_ack(self):
+        return WINDOW_HEADER.pack(b"A", self.transfer_id, 0)
+
+    def is_complete(self):
+        return self.expected == self.chunk_count
+
+    def on_data(self, data):
+        _, _, seqno, checksum = DATA_HEADER.unpack_from(data)
+        if packet_checksum(data, data[DATA_HEADER.size:]) != checksum:
+            # Only this chunk is asked for again, the rest of the window is unaffected
+            print(f"Server: Corrupted chunk {seqno} of {self.file_name}")
+            return WINDOW_HEADER.pack(b"N", self.transfer_id, seqno)
+        if (self.expected <= seqno < min(self.expected + self.window, self.chunk_count)
+                and seqno not in self.received):
+            print(f"Server: Received chunk {seqno} of {self.file_name}")
+            self.file.write_at(self.offset + seqno * WINDOW_MSS, data[DATA_HEADER.size:])
+            self.received.add(seqno)
+            while self.expected in self.received:
+                self.received.remove(self.expected)
+                self.expected += 1
+        if self.is_complete():
+            self.finish()
+        WINDOW_HEADER.pack_into(self.ack, 0, b"A", self.transfer_id, self.expected)
+        sacks = sorted(self.received)
+        for i, sack in enumerate(sacks):
+            SACK_ENTRY.pack_into(self.ack, WINDOW_HEADER.size + i * SACK_ENTRY.size, sack)
+        return memoryview(self.ack)[:WINDOW_HEADER.size + len(sacks) * SACK_ENTRY.size]
+
+    def finish(self):
+        # The file is closed once the last stripe writing to it has finished
+        if self.finished:
+            return
+        self.finished = True
+        self.file.sessions -= 1
+        if self.file.sessions == 0:
+            self.file.close()
+            del self.files[self.file_name]
+
+
+def packet_checksum(header, payload):
+    # CRC-32 of a data packet, computed without copying the header and payload together
+    return zlib.crc32(payload, zlib.crc32(b"\x00\x00\x00\x00", zlib.crc32(header[:CRC_OFFSET])))
+
+
+def session_key(data, addr):
+    # Stop-and-wait data packets look like "d|1|...", windowed ones start with a DATA_HEADER
+    if data[0:1] == b"d":
+        return addr, 0
+    return addr, DATA_HEADER.unpack_from(data)[1]
+
+
+def file_digest(file_name):
+    # SHA-256 computed in one sequential pass over a memory map, the file is never copied into Python buffers
+    with open(file_name, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.sha256(mm).hexdigest()
+
+
+class VerificationSession:
+    # End-to-end check of a whole file, v|{transfer_id}|{file_name}|{file_size}|{sha256}.
+    # The file is hashed on a worker thread so the receive loop keeps serving the other sessions,
+    # requests are answered o|{transfer_id}|pending until the digest is ready. Kept in a table of their own
+    # (a transfer id may also name a data session) so that retransmitted requests are not hashed again.
+    def __init__(self, files, data):
+        _, self.transfer_id, self.file_name, file_size, digest = bytes(data).decode().split("|")
+        self.file_size = int(file_size)
+        self.files = files
+        self.ok = None  # set by the worker thread
+        self.reply = None
+        self.last_active = time.monotonic()
+        Thread(target=self.verify, args=(self.file_size, digest), daemon=True).start()
+
+    def verify(self, file_size, digest):
+        try:
+            self.ok = os.path.getsize(self.file_name) == file_size and file_digest(self.file_name) == digest
+        except OSError:
+            self.ok = False
+
+    def answer(self):
+        # The outcome is applied here, on the receive loop, which owns `files`
+        if self.reply is None and self.ok is not None:
+            file = self.files.get(self.file_name)
+            # An upload of the file with another size in progress is left alone
+            if not self.ok and (file is None or file.file_size == self.file_size):
+                # Nothing received so far can be trusted, a resumed upload has to send the whole file
+                if file is not None:
+                    file.held.clear()
+                if os.path.exists(f"{self.file_name}.ranges"):
+                    os.remove(f"{self.file_name}.ranges")
+            print(f"Server: File {self.file_name} {'verified' if self.ok else 'failed verification'}")
+            self.reply = f"o|{self.transfer_id}|{'ok' if self.ok else 'bad'}".encode()
+        return self.reply or f"o|{self.transfer_id}|pending".encode()
+
+    def finish(self):
+        pass
+
+
+def start_session(sessions, files, data, addr):
+    file_info = bytes(data).decode().split("|")
+    file_name = file_info[2]
+    file_size = int(file_info[3])
+    if len(file_info) > 4:
+        # Windowed transfer: s|{transfer_id}|{file_name}|{file_size}|{window}[|{offset}|{length}]
+        key = (addr, int(file_info[1], 16))
+        if int(file_info[4]) < 1:
+            raise ValueError("Invalid window")  # no chunk would ever fit in it
+    else:
+        # Stop-and-wait transfer: s|0|{file_name}|{file_size}
+        key = (addr, 0)
+    session = sessions.get(key)
+    if session is not None and not session.is_complete():
+        session.last_active = time.monotonic()
+        # Our ACK for the start packet was lost, the client is still waiting for it
+        return session.start_ack()
+    if session is not None:
+        session.finish()
+    if len(file_info) > 5:
+        offset, length = int(file_info[5]), int(file_info[6])
+    else:
+        offset, length = 0, file_size
+    if len(file_info) > 4 and file_name in files and files[file_name].file_size != file_size:
+        # Another upload of this file with a different size is in progress, they cannot share it
+        print(f"Server: Rejected {file_name} ({file_size} bytes) from {addr}, "
+              f"{files[file_name].file_size} bytes are being received")
+        return WINDOW_HEADER.pack(b"E", key[1], 0)
+    print(f"Server: Receiving file {file_name} ({file_size} bytes, {length} from offset {offset}) from {addr}")
+    if len(file_info) > 4:
+        session = WindowedSession(files, key[1], file_name, file_size, int(file_info[4]), offset, length)
+    else:
+        session = StopAndWaitSession(file_name, file_size)
+    sessions[key] = session
+    if session.is_complete():
+        session.finish()
+    return session.start_ack()
+
+
+def evict_idle_sessions(sessions):
+    # Completed sessions are kept around until they go idle so that retransmissions
+    # of the last chunk (lost final ACK) can still be acknowledged.
+    now = time.monotonic()
+    for key, session in list(sessions.items()):
+        if now - session.last_active > SESSION_TIMEOUT:
+            session.finish()
+            del sessions[key]
+
 
 def main(port):
+    sessions = {}  # (client address, transfer id) -> data session
+    verifications = {}  # (client address, transfer id) -> VerificationSession
+    files = {}  # file name -> ReceivedFile shared by the windowed sessions writing to it
+    # Every datagram is received into the same preallocated buffer: it is handled completely, chunks are
+    # written with os.pwrite and the reply is sent, before the next one is received
+    buffer = bytearray(SERVER_BUFFER)
+    view = memoryview(buffer)
     with socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM) as s:
         s.bind(("0.0.0.0", port))
+        s.settimeout(SWEEP_INTERVAL)
         print(f"Server: Listening on port {port}")
 
+        last_sweep = time.monotonic()
         while True:
             try:
-                data, addr = s.recvfrom(MSS)
-                message_type = data[0:1].decode()
-                if message_type == "s":
+                if time.monotonic() - last_sweep >= SWEEP_INTERVAL:
+                    evict_idle_sessions(sessions)
+                    evict_idle_sessions(verifications)
+                    last_sweep = time.monotonic()
+                nbytes, addr = s.recvfrom_into(buffer)
+                data = view[:nbytes]
+                message_type = data[0:1]
+                if message_type == b"s":
                     # Start of file transfer
-                    file_info = data.decode().split("|")
-                    file_name = file_info[2]
-                    file_size = int(file_info[3])
-                    print(f"Server: Receiving file {file_name} ({file_size} bytes)")
-                    ack = b"a|1"
-                    s.sendto(ack, addr)
-                    receive_file(s, file_name, file_size)
+                    s.sendto(start_session(sessions, files, data, addr), addr)
+                elif message_type == b"v":
+                    # Whole-file digest check once every stripe is acknowledged
+                    key = (addr, int(bytes(data[2:10]).decode(), 16))
+                    if key not in verifications:
+                        verifications[key] = VerificationSession(files, data)
+                    verifications[key].last_active = time.monotonic()
+                    s.sendto(verifications[key].answer(), addr)
+                elif message_type == b"r":
+                    # Resume handshake, reports the byte ranges already held
+                    s.sendto(held_ranges_reply(files, data), addr)
+                elif message_type == b"d" or message_type == b"D":
+                    session = sessions.get(session_key(data, addr))
+                    if session is None:
+                        raise ValueError("Invalid message")
+                    session.last_active = time.monotonic()
+                    s.sendto(session.on_data(data), addr)
                 else:
                     raise ValueError("Invalid message")
-            except ValueError:
+            except socket.timeout:
+                continue
+            except (ValueError, IndexError, struct.error, UnicodeDecodeError):
                 print("Server: Invalid message received")
             except KeyboardInterrupt:
                 print("Server: Exiting...")
+                for session in sessions.values():
+                    session.finish()
                 exit()
 
 if __name__ == "__main__":
@@ -1,61 +1,473 @@
 import argparse
+import hashlib
+import json
 import math
+import mmap
 import os
+import random
 import socket
+import struct
+import time
+import zlib
+from queue import Empty, Queue
+from threading import Thread
 
 MSS = 20476  # MSS = Server buffer size (20480) - data header size (4)
+# Windowed ACK header: type (b"A" / b"N" / b"E"), transfer id, cumulative ACK (ACK), corrupted seqno (NACK)
+# or 0 (E, the start packet was rejected).
+# ACKs are followed by the selectively acknowledged seqnos, one SACK_ENTRY each.
+WINDOW_HEADER = struct.Struct("!cIQ")
+# Windowed data header: type (b"D"), transfer id, seqno, CRC-32 of the header (with the CRC field zeroed)
+# and the payload, so a corrupted seqno or transfer id is caught like a corrupted payload
+DATA_HEADER = struct.Struct("!cIQI")
+CRC_OFFSET = 13  # position of the CRC field in DATA_HEADER
+SACK_ENTRY = struct.Struct("!Q")
+WINDOW_MSS = 20463  # Server buffer size (20480) - windowed data header size (17)
+ACK_BUFFER = 1024
+INITIAL_RTO = 1  # seconds, used until the first RTT sample arrives
+MIN_RTO = 0.01
+MAX_RTO = 60
+VERIFY_POLL_INTERVAL = 0.05  # seconds between verification requests while the server is still hashing
+RTT_HISTOGRAM_BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5]  # upper bounds, seconds
 
-def await_ack(packet):
-    s.settimeout(1)
+
+class RttEstimator:
+    # Jacobson/Karels retransmission timer (RFC 6298): RTO = SRTT + 4 * RTTVAR,
+    # doubled on every timeout and recomputed from the next fresh sample.
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = INITIAL_RTO
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, MIN_RTO), MAX_RTO)
+
+    def backoff(self):
+        self.rto = min(self.rto * 2, MAX_RTO)
+
+
+class CongestionWindow:
+    # AIMD window in chunks: slow start up to ssthresh, then +1 chunk per window of ACKs,
+    # halved at most once per window of data when a loss is detected.
+    def __init__(self, max_window):
+        self.max_window = max_window
+        self.cwnd = 1.0
+        self.ssthresh = max_window
+        self.recover = -1  # losses below this seqno belong to an already handled loss event
+
+    def size(self):
+        return max(1, min(self.max_window, int(self.cwnd)))
+
+    def on_ack(self, acked_chunks):
+        for _ in range(acked_chunks):
+            if self.cwnd < self.ssthresh:
+                self.cwnd += 1
+            else:
+                self.cwnd += 1 / self.cwnd
+        self.cwnd = min(self.cwnd, self.max_window)
+
+    def on_loss(self, seqno, next_seqno):
+        if seqno < self.recover:
+            return
+        self.ssthresh = max(self.cwnd / 2, 1)
+        self.cwnd = self.ssthresh
+        self.recover = next_seqno
+
+
+class TransferStats:
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.started = time.monotonic()
+        self.finished = None
+        self.packets_sent = 0
+        self.retransmits = 0
+        self.bytes_acked = 0
+        self.rtt_histogram = [0] * (len(RTT_HISTOGRAM_BUCKETS) + 1)  # last bucket is overflow
+
+    def record_rtt(self, rtt):
+        for i, bound in enumerate(RTT_HISTOGRAM_BUCKETS):
+            if rtt <= bound:
+                self.rtt_histogram[i] += 1
+                return
+        self.rtt_histogram[-1] += 1
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    def as_dict(self):
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return {
+            "elapsed": elapsed,
+            "packets_sent": self.packets_sent,
+            "retransmits": self.retransmits,
+            "bytes_acked": self.bytes_acked,
+            "goodput": self.bytes_acked / elapsed if elapsed > 0 else 0,  # bytes per second
+            "srtt": self.rtt.srtt,
+            "rto": self.rtt.rto,
+            "rtt_histogram": {
+                **{f"<={bound}": count for bound, count in zip(RTT_HISTOGRAM_BUCKETS, self.rtt_histogram)},
+                f">{RTT_HISTOGRAM_BUCKETS[-1]}": self.rtt_histogram[-1],
+            },
+        }
+
+
+class Flow:
+    # One UDP flow to the server with its own socket, retransmission timer and statistics
+    def __init__(self, server_addr):
+        self.sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        self.server_addr = server_addr
+        self.rtt = RttEstimator()
+        self.stats = TransferStats(self.rtt)
+
+    def send_packet(self, packet, retransmission=False):
+        # `packet` is a list of buffers (header, payload view) sent as one datagram without joining them
+        self.sock.sendmsg(packet, [], 0, self.server_addr)
+        self.stats.packets_sent += 1
+        if retransmission:
+            self.stats.retransmits += 1
+
+    def on_rtt_sample(self, sample):
+        self.rtt.sample(sample)
+        self.stats.record_rtt(sample)
+
+    def close(self):
+        self.stats.finish()
+        self.sock.close()
+
+
+def packet_checksum(header, payload):
+    # CRC-32 of a data packet, computed without copying the header and payload together
+    return zlib.crc32(payload, zlib.crc32(b"\x00\x00\x00\x00", zlib.crc32(header[:CRC_OFFSET])))
+
+
+def await_ack(flow, packet):
+    sent_at = time.monotonic()
+    retransmitted = False
+    flow.sock.settimeout(flow.rtt.rto)
+    ack = bytearray(ACK_BUFFER)
     while True:
         try:
-            data, addr = s.recvfrom(1024)
-            print(f"Server: {data.decode()}")
-            received_ack_seqno = int(data[2:3].decode())
-            expected_ack_seqno = (int(packet[2:3].decode()) + 1) % 2
+            nbytes, addr = flow.sock.recvfrom_into(ack)
+            print(f"Server: {ack[:nbytes].decode()}")
+            received_ack_seqno = ack[2] - ord("0")
+            expected_ack_seqno = (packet[0][2] - ord("0") + 1) % 2
             if received_ack_seqno != expected_ack_seqno:
                 continue
+            if not retransmitted:  # Karn's algorithm: ambiguous samples are discarded
+                flow.on_rtt_sample(time.monotonic() - sent_at)
             return True
         except KeyboardInterrupt:
             print("Client: Exiting...")
             exit()
-        except socket.timeout:  # Expected ACK was not received within one second
+        except socket.timeout:  # Expected ACK was not received within the retransmission timeout
             print(f"Client: Retransmitting...")
-            s.sendto(packet, (server_ip, server_port))
+            flow.rtt.backoff()
+            flow.sock.settimeout(flow.rtt.rto)
+            flow.send_packet(packet, retransmission=True)
+            retransmitted = True
+
+
+def await_start_ack(flow, packet, transfer_id):
+    sent_at = time.monotonic()
+    retransmitted = False
+    flow.sock.settimeout(flow.rtt.rto)
+    ack = bytearray(ACK_BUFFER)
+    while True:
+        try:
+            nbytes, addr = flow.sock.recvfrom_into(ack)
+            message_type, ack_transfer_id, cumulative_ack = WINDOW_HEADER.unpack_from(ack)
+            print(f"Server: {message_type.decode()}|{ack_transfer_id:08x}|{cumulative_ack}")
+            if ack_transfer_id != transfer_id:
+                continue
+            if message_type == b"E":
+                return False
+            if message_type != b"A":
+                continue
+            if not retransmitted:
+                flow.on_rtt_sample(time.monotonic() - sent_at)
+            return True
+        except KeyboardInterrupt:
+            print("Client: Exiting...")
+            exit()
+        except socket.timeout:
+            print(f"Client: Retransmitting...")
+            flow.rtt.backoff()
+            flow.sock.settimeout(flow.rtt.rto)
+            flow.send_packet(packet, retransmission=True)
+            retransmitted = True
+
+
+def await_reply(flow, packet, message_type, transfer_id):
+    # Waits for a text control reply {message_type}|{transfer_id}|{body} and returns the body
+    flow.sock.settimeout(flow.rtt.rto)
+    reply = bytearray(ACK_BUFFER * 16)
+    while True:
+        try:
+            nbytes, addr = flow.sock.recvfrom_into(reply)
+            message = reply[:nbytes].decode().split("|")
+            print(f"Server: {reply[:nbytes].decode()}")
+            if message[0] != message_type or message[1] != f"{transfer_id:08x}":
+                continue
+            return message[2]
+        except KeyboardInterrupt:
+            print("Client: Exiting...")
+            exit()
+        except (socket.timeout, UnicodeDecodeError):
+            print(f"Client: Retransmitting...")
+            flow.rtt.backoff()
+            flow.sock.settimeout(flow.rtt.rto)
+            flow.send_packet(packet, retransmission=True)
+
+
+def file_digest(file_path):
+    # SHA-256 computed in one sequential pass over a memory map, the file is never copied into Python buffers
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.sha256(mm).hexdigest()
+
+
+def missing_ranges(held, file_size):
+    missing = []
+    position = 0
+    for start, end in sorted(held):
+        if start > position:
+            missing.append((position, start))
+        position = max(position, end)
+    if position < file_size:
+        missing.append((position, file_size))
+    return missing
+
+
+def plan_stripes(ranges, streams):
+    # Cuts the byte ranges still to be sent into (offset, length) stripes of about 1/streams of the total
+    total = sum(end - start for start, end in ranges)
+    stripe_size = max(1, math.ceil(total / streams / WINDOW_MSS)) * WINDOW_MSS
+    stripes = []
+    for start, end in ranges:
+        while start < end:
+            stripes.append((start, min(end, start + stripe_size) - start))
+            start += stripe_size
+    return stripes
+
+
+def upload_stripes(flow, stripes, window, selective):
+    # Worker for one parallel flow: uploads stripes from the shared queue until it is empty
+    with open(args.file_path, "rb") as f:
+        while True:
+            try:
+                offset, length = stripes.get_nowait()
+            except Empty:
+                break
+            transfer_id = random.getrandbits(32)
+            packet = f"s|{transfer_id:08x}|{file_name}|{file_size}|{window}|{offset}|{length}".encode()
+            print(f"Client: {packet.decode()}")
+            flow.send_packet([packet])
+            if not await_start_ack(flow, [packet], transfer_id):
+                print(f"Client: Server rejected {file_name}, another upload with a different size is in progress")
+                break
+            f.seek(offset)
+            send_windowed(flow, f, transfer_id, length, window, selective)
+    flow.close()
+
+
+def send_windowed(flow, f, transfer_id, length, window, selective):
+    # Keeps up to min(`window`, cwnd) chunks in flight. Go-Back-N resends everything from the base
+    # on a timeout, Selective Repeat resends only the chunks that were neither cumulatively nor
+    # selectively acknowledged.
+    # Chunk `seqno` is read straight into ring slot `seqno % window`; in-flight seqnos always lie in
+    # [base, base + window), so a slot is never overwritten before its chunk is acknowledged.
+    payloads = [memoryview(bytearray(WINDOW_MSS)) for _ in range(window)]
+    headers = [bytearray(DATA_HEADER.size) for _ in range(window)]
+    ack = bytearray(WINDOW_HEADER.size + SACK_ENTRY.size * window)
+    chunk_count = math.ceil(length / WINDOW_MSS)
+    congestion = CongestionWindow(window)
+    base = 0
+    next_seqno = 0
+    in_flight = {}  # seqno -> [packet, sent at, retransmission deadline, retransmitted]
+    while base < chunk_count:
+        while next_seqno < chunk_count and next_seqno < base + congestion.size():
+            print(f"Client: D|{next_seqno}|chunk{next_seqno + 1}")
+            slot = next_seqno % window
+            chunk_length = f.readinto(payloads[slot][:min(WINDOW_MSS, length - next_seqno * WINDOW_MSS)])
+            packet = [headers[slot], payloads[slot][:chunk_length]]
+            DATA_HEADER.pack_into(headers[slot], 0, b"D", transfer_id, next_seqno, 0)
+            struct.pack_into("!I", headers[slot], CRC_OFFSET, packet_checksum(headers[slot], packet[1]))
+            flow.send_packet(packet)
+            now = time.monotonic()
+            in_flight[next_seqno] = [packet, now, now + flow.rtt.rto, False]
+            next_seqno += 1
+
+        flow.sock.settimeout(max(0.001, min(entry[2] for entry in in_flight.values()) - time.monotonic()))
+        try:
+            nbytes, addr = flow.sock.recvfrom_into(ack)
+            message_type, ack_transfer_id, cumulative_ack = WINDOW_HEADER.unpack_from(ack)
+            if ack_transfer_id != transfer_id:
+                continue
+            now = time.monotonic()
+            if message_type == b"N":
+                # The chunk arrived corrupted, not lost: resend it at once and leave the timers alone
+                seqno = cumulative_ack
+                if seqno in in_flight:
+                    print(f"Client: Retransmitting corrupted chunk {seqno}...")
+                    flow.send_packet(in_flight[seqno][0], retransmission=True)
+                    in_flight[seqno][2] = now + flow.rtt.rto
+                    in_flight[seqno][3] = True
+                continue
+            if message_type != b"A":
+                continue
+            acked = [seqno for seqno in range(base, cumulative_ack) if seqno in in_flight]
+            if selective:
+                for offset in range(WINDOW_HEADER.size, nbytes, SACK_ENTRY.size):
+                    seqno = SACK_ENTRY.unpack_from(ack, offset)[0]
+                    if seqno in in_flight:
+                        acked.append(seqno)
+            for seqno in acked:
+                packet, sent_at, deadline, retransmitted = in_flight.pop(seqno)
+                flow.stats.bytes_acked += len(packet[1])
+                if not retransmitted and seqno == acked[-1]:
+                    flow.on_rtt_sample(now - sent_at)  # one sample per ACK, from the newest chunk it covers
+            congestion.on_ack(len(acked))
+            base = max(base, cumulative_ack)
+        except KeyboardInterrupt:
+            print("Client: Exiting...")
+            exit()
+        except socket.timeout:
+            now = time.monotonic()
+            expired = [seqno for seqno in sorted(in_flight) if in_flight[seqno][2] <= now]
+            if not expired:
+                continue
+            flow.rtt.backoff()
+            congestion.on_loss(expired[0], next_seqno)
+            for seqno in sorted(in_flight):
+                if selective and seqno not in expired:
+                    continue
+                print(f"Client: Retransmitting chunk {seqno}...")
+                flow.send_packet(in_flight[seqno][0], retransmission=True)
+                in_flight[seqno][2] = now + flow.rtt.rto
+                in_flight[seqno][3] = True
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("server_addr", type=str)
     parser.add_argument("file_path", type=str)
+    parser.add_argument("--mode", choices=["saw", "gbn", "sr"], default="saw",
+                        help="stop-and-wait, Go-Back-N or Selective Repeat")
+    parser.add_argument("--window", type=positive_int, default=16, help="maximum window size in chunks (gbn/sr only)")
+    parser.add_argument("--streams", type=positive_int, default=1, help="number of parallel UDP flows (gbn/sr only)")
+    parser.add_argument("--resume", action="store_true",
+                        help="ask the server which byte ranges it already holds and send only the rest (gbn/sr only)")
+    parser.add_argument("--stats", type=str, help="write per-transfer statistics as JSON to this file")
     args = parser.parse_args()
 
     server_ip, server_port = args.server_addr.split(":")
-    server_port = int(server_port)
+    server_addr = (server_ip, int(server_port))
     file_name = args.file_path.split(os.path.sep)[-1]
+
+    # Check file existence
+    if not os.path.exists(args.file_path):
+        print(f"Client: no such file: {args.file_path}")
+        exit()
     file_size = os.path.getsize(args.file_path)
 
-    with socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM) as s:
+    started = time.monotonic()
+    flows = []
+    if args.mode != "saw":
+        ranges = [(0, file_size)]
+        if args.resume:
+            flow = Flow(server_addr)
+            transfer_id = random.getrandbits(32)
+            packet = f"r|{transfer_id:08x}|{file_name}|{file_size}".encode()
+            print(f"Client: {packet.decode()}")
+            flow.send_packet([packet])
+            reply = await_reply(flow, [packet], "h", transfer_id)
+            held = [tuple(int(bound) for bound in held.split("-")) for held in reply.split(",") if held]
+            ranges = missing_ranges(held, file_size)
+            flow.close()
+            print(f"Client: {file_size - sum(end - start for start, end in ranges)} bytes already on the server")
 
-        # Check file existence
-        if not os.path.exists(args.file_path):
-            print(f"Client: no such file: {args.file_path}")
-            exit()
+        stripes = Queue()
+        planned = plan_stripes(ranges, args.streams)
+        if not planned and not args.resume:
+            planned = [(0, 0)]  # an empty file still needs its start packet
+        for stripe in planned:
+            stripes.put(stripe)
+
+        # Each parallel flow has its own socket, so the server sees it as a separate session
+        threads = []
+        for _ in range(min(args.streams, len(planned))):
+            flow = Flow(server_addr)
+            flows.append(flow)
+            threads.append(Thread(target=upload_stripes, args=(flow, stripes, args.window, args.mode == "sr"), daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # End-to-end check: the server hashes its copy the same way and compares
+        flow = Flow(server_addr)
+        transfer_id = random.getrandbits(32)
+        packet = f"v|{transfer_id:08x}|{file_name}|{file_size}|{file_digest(args.file_path)}".encode()
+        print(f"Client: {packet.decode()}")
+        flow.send_packet([packet])
+        while (reply := await_reply(flow, [packet], "o", transfer_id)) == "pending":
+            time.sleep(VERIFY_POLL_INTERVAL)
+            flow.send_packet([packet])
+        verified = reply == "ok"
+        flow.close()
+        print(f"Client: File {file_name} {'verified' if verified else 'failed verification, upload it again'}")
+    else:
+        flow = Flow(server_addr)
+        flows.append(flow)
 
         # Send start packet to server
         packet = f"s|0|{file_name}|{file_size}".encode()
         print(f"Client: {packet.decode()}")
-        s.sendto(packet, (server_ip, server_port))
+        flow.send_packet([packet])
 
         # Wait for ACK for the given packet
-        await_ack(packet)
+        await_ack(flow, [packet])
 
-        # Upload file to server
+        # Upload file to server, reading every chunk into the same buffer
         seqno = 1
+        headers = [b"d|0|", b"d|1|"]
+        payload = memoryview(bytearray(MSS))
         with open(args.file_path, "rb") as f:
             for i in range(math.ceil(file_size / MSS)):
                 print(f"Client: d|{seqno}|chunk{i + 1}")
-                packet = bytes(f"d|{seqno}|", "utf-8") + f.read(MSS)
-                s.sendto(packet, (server_ip, server_port))
-                await_ack(packet)
+                length = f.readinto(payload)
+                packet = [headers[seqno], payload[:length]]
+                flow.send_packet(packet)
+                await_ack(flow, packet)
+                flow.stats.bytes_acked += length
                 seqno = (seqno + 1) % 2
+        flow.close()
+
+    elapsed = time.monotonic() - started
+    bytes_acked = sum(flow.stats.bytes_acked for flow in flows)
+    summary = {
+        "elapsed": elapsed,
+        "retransmits": sum(flow.stats.retransmits for flow in flows),
+        "bytes_acked": bytes_acked,
+        "goodput": bytes_acked / elapsed if elapsed > 0 else 0,  # bytes per second, all flows together
+        "flows": [flow.stats.as_dict() for flow in flows],
+    }
+    print(f"Client: {json.dumps(summary)}")
+    if args.stats:
+        with open(args.stats, "w") as f:
+            json.dump(summary, f, indent=2)
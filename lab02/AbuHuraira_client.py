@@ -4,72 +4,228 @@
 # Note: Since the creation of the GIF is CPU intensive, we will use multiple processes to create the GIF.
 # On the other hand, the downloading of the frames is I/O intensive, so we will use multiple threads to download the frames.
 
+import io
 import os
 import socket
+import struct
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from multiprocessing import Pool
-from threading import Thread
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
 from PIL import Image
 
 SERVER_URL = '127.0.0.1:1234'
 FILE_NAME = 'AbuHuraira.gif'
-CLIENT_BUFFER = 1024
+CLIENT_BUFFER = 256 * 1024  # receive buffer of each connection, also requested as SO_RCVBUF
 FRAME_COUNT = 5000
 NUM_PROCESSES = os.cpu_count()  # number of processes to use for GIF creation
-NUM_THREADS = 10  # number of threads to use for downloading frames
+NUM_THREADS = 10  # number of threads to use for downloading frames, each with one long-lived connection
+PIPELINE_DEPTH = 100  # requests sent ahead before reading their responses
+FRAMES_PER_CHUNK = 250  # frames a GIF worker decodes into one array at a time, bounds its memory
+FRAME_DURATION = 500  # ms each frame is shown
+PALETTE_SAMPLE_FRAMES = 500  # frames decoded to compute the shared palette
+LUT_BITS = 5  # bits per channel of the color -> palette index lookup table
 
+# Framed protocol: the client sends any number of requests (frame id) without waiting,
+# the server answers each one in order with the PNG length followed by the PNG bytes.
+REQUEST = struct.Struct('!I')
+RESPONSE_HEADER = struct.Struct('!I')
 
-def download_frames(start, end):
+
+class FrameReader:
+    """Splits the length-prefixed responses of one connection out of a preallocated receive buffer"""
+    def __init__(self, sock, size):
+        self.sock = sock
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # first unread byte
+        self.end = 0  # end of the received bytes
+
+    def fill(self, needed):
+        """Receives until at least `needed` unread bytes are in the buffer"""
+        if self.start + needed > len(self.buffer):
+            # Move the unread tail to the front, or into a bigger buffer for an oversized frame
+            unread = self.end - self.start
+            if needed > len(self.buffer):
+                buffer = bytearray(needed)
+                buffer[:unread] = self.view[self.start:self.end]
+                self.buffer, self.view = buffer, memoryview(buffer)
+            else:
+                self.view[:unread] = self.view[self.start:self.end]
+            self.start, self.end = 0, unread
+        while self.end - self.start < needed:
+            n = self.sock.recv_into(self.view[self.end:])
+            if n == 0:
+                raise ConnectionError("Server closed the connection in the middle of a frame")
+            self.end += n
+
+    def read_frame(self):
+        self.fill(RESPONSE_HEADER.size)
+        length, = RESPONSE_HEADER.unpack_from(self.buffer, self.start)
+        self.start += RESPONSE_HEADER.size
+        self.fill(length)
+        frame = bytes(self.view[self.start:self.start + length])
+        self.start += length
+        return frame
+
+
+def decode_frame(png):
+    return np.asarray(Image.open(io.BytesIO(png)).convert("RGB"))
+
+
+def download_frames(frames, start, end):
+    # Downloads frames [start, end) over one connection and decodes each one straight into its slot of `frames`
     ip, port = SERVER_URL.split(':')
-    for i in range(start, end):
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((ip, int(port)))
-            image = b''
-            while True:
-                packet = s.recv(CLIENT_BUFFER)
-                if not packet:
-                    break
-                image += packet
-            with open(f'frames/{i}.png', 'wb') as f:
-                f.write(image)
-
-
-def create_gif(process_id):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, CLIENT_BUFFER)
+        s.connect((ip, int(port)))
+        reader = FrameReader(s, CLIENT_BUFFER)
+        for batch_start in range(start, end, PIPELINE_DEPTH):
+            frame_ids = range(batch_start, min(batch_start + PIPELINE_DEPTH, end))
+            s.sendall(b''.join(REQUEST.pack(i) for i in frame_ids))
+            for i in frame_ids:
+                frames[i] = decode_frame(reader.read_frame())
+
+
+def frame_shape():
+    # The arena is sized from the first frame, every frame has the same dimensions
+    ip, port = SERVER_URL.split(':')
+    with socket.create_connection((ip, int(port))) as s:
+        s.sendall(REQUEST.pack(0))
+        frame = decode_frame(FrameReader(s, CLIENT_BUFFER).read_frame())
+    return frame.shape
+
+
+def attach_frames(arena, count, shape):
+    # (frames, height, width, 3) view over a shared memory arena
+    return np.ndarray((count,) + tuple(shape), dtype=np.uint8, buffer=arena.buf)
+
+
+def gif_header(width, height, palette, loop=0):
+    # GIF89a header with the shared 256-color palette as global color table and the NETSCAPE2.0 loop extension
+    screen = struct.pack('<HHBBB', width, height, 0xf7, 0, 0)
+    return (b'GIF89a' + screen + palette.tobytes()
+            + b'\x21\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', loop) + b'\x00')
+
+
+def gif_frame_block(gif, duration):
+    # Turns a single-frame GIF into a block that can be appended to an animation: a graphic control
+    # extension carrying the frame delay, then the image descriptor without the frame's own color table,
+    # which is the animation's shared palette, then the LZW image data
+    flags = gif[10]
+    pos = 13
+    if flags & 0x80:
+        pos += 3 << ((flags & 0x07) + 1)
+    while gif[pos] == 0x21:  # skip extensions, the delay is written below
+        pos += 2
+        while gif[pos]:
+            pos += gif[pos] + 1
+        pos += 1
+    descriptor = gif[pos:pos + 10]
+    pos += 10
+    control = b'\x21\xf9\x04\x04' + struct.pack('<H', duration // 10) + b'\x00\x00'
+    return control + descriptor + gif[pos:-1]  # drop the trailer
+
+
+def shared_palette(frames):
+    # One 256-color palette for the whole animation, computed from a sample of the frames
+    sample = frames[::max(1, len(frames) // PALETTE_SAMPLE_FRAMES)]
+    mosaic = Image.fromarray(sample.reshape(1, -1, 3), "RGB")
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    colors = np.array(mosaic.quantize(256).getpalette(), dtype=np.uint8).reshape(-1, 3)[:256]
+    palette[:len(colors)] = colors
+    return palette
+
+
+def palette_lut(palette):
+    # Nearest palette index for every color at LUT_BITS bits per channel,
+    # so quantizing an array is a single table lookup per pixel
+    levels = (np.arange(1 << LUT_BITS) << (8 - LUT_BITS)) + (1 << (7 - LUT_BITS))
+    g, b = np.meshgrid(levels, levels, indexing='ij')
+    palette = palette.astype(np.int32)
+    lut = np.empty((1 << LUT_BITS,) * 3, dtype=np.uint8)
+    for i, r in enumerate(levels):
+        cells = np.stack([np.full_like(g, r), g, b], axis=-1).reshape(-1, 1, 3)
+        distances = ((cells - palette[np.newaxis]) ** 2).sum(axis=-1)
+        lut[i] = distances.argmin(axis=1).reshape(g.shape)
+    return lut
+
+
+def quantize_frames(pixels, lut):
+    # Vectorized palettization of a whole (frames, height, width, 3) array
+    shift = 8 - LUT_BITS
+    return lut[pixels[..., 0] >> shift, pixels[..., 1] >> shift, pixels[..., 2] >> shift]
+
+
+def init_gif_worker(arena_name, count, shape, palette, lut):
+    # GIF workers map the decoded frames instead of receiving them pickled
+    global worker_arena, worker_frames, worker_palette, worker_lut
+    worker_arena = SharedMemory(name=arena_name)
+    worker_frames = attach_frames(worker_arena, count, shape)
+    worker_palette = palette.tobytes()
+    worker_lut = lut
+
+
+def encode_frames(frame_range):
+    # GIF worker: palettizes a contiguous range of the shared frames in a single vectorized pass
+    # against the shared palette and LZW-encodes every frame
     t0 = time.time()
-    frames = []
-    for frame_id in range(process_id, FRAME_COUNT, NUM_PROCESSES):
-        frames.append(Image.open(f"frames/{frame_id}.png").convert("RGBA"))
-    frames[0].save(f"{process_id}.gif", format="GIF",
-                   append_images=frames[1:], save_all=True, duration=500, loop=0)
-    return time.time() - t0
+    indices = quantize_frames(worker_frames[frame_range[0]:frame_range[1]], worker_lut)
+    blocks = []
+    for frame in indices:
+        image = Image.fromarray(frame, "P")
+        image.putpalette(worker_palette)
+        gif = io.BytesIO()
+        image.save(gif, format="GIF", optimize=False)
+        blocks.append(gif_frame_block(gif.getvalue(), FRAME_DURATION))
+    return blocks, time.time() - t0
+
+
+def create_gif(arena, frames, file_name):
+    # Workers encode contiguous ranges of the shared arena in parallel, imap hands the results
+    # back in order and this process streams them into a single GIF as they arrive
+    count, height, width, _ = frames.shape
+    palette = shared_palette(frames)
+    lut = palette_lut(palette)
+    chunk_size = max(1, min(FRAMES_PER_CHUNK, -(-count // NUM_PROCESSES)))
+    chunks = [(i, min(i + chunk_size, count)) for i in range(0, count, chunk_size)]
+    encode_time = 0
+    write_time = 0
+    initargs = (arena.name, count, frames.shape[1:], palette, lut)
+    with Pool(processes=NUM_PROCESSES, initializer=init_gif_worker, initargs=initargs) as pool, \
+            open(file_name, 'wb') as f:
+        f.write(gif_header(width, height, palette))
+        for blocks, elapsed in pool.imap(encode_frames, chunks):
+            encode_time += elapsed
+            t0 = time.time()
+            f.writelines(blocks)
+            write_time += time.time() - t0
+        f.write(b'\x3b')
+    return encode_time, write_time
 
 
 if __name__ == '__main__':
     print("Downloading frames...")
     t0 = time.time()
-    if not os.path.exists('frames'):
-        os.mkdir('frames')
-    pool = Pool(processes=NUM_THREADS)
-    batch_size = FRAME_COUNT // NUM_THREADS
-    for i in range(NUM_THREADS):
-        start = i * batch_size
-        end = (i + 1) * batch_size
-        pool.apply_async(download_frames, args=(start, end))
-    pool.close()
-    pool.join()
-    print(f"Frames download time: {time.time() - t0:.2f}s")
-
-    print("Creating GIF...")
-    t0 = time.time()
-    pool = Pool(processes=NUM_PROCESSES)
-    for i in range(NUM_PROCESSES):
-        pool.apply_async(create_gif, args=(i,))
-    pool.close()
-    pool.join()
-    gif_files = [f"{i}.gif" for i in range(NUM_PROCESSES)]
-    with open(FILE_NAME, 'wb') as f:
-        for gif_file in gif_files:
-            with open(gif_file, 'rb') as g:
-                f.write(g.read())
-            os.remove(gif_file)
-    print(f"GIF creation time: {time.time() - t0:.2f}s")
+    # Frames are decoded into a shared memory arena that the GIF workers read directly
+    shape = frame_shape()
+    arena = SharedMemory(create=True, size=FRAME_COUNT * int(np.prod(shape)))
+    try:
+        frames = attach_frames(arena, FRAME_COUNT, shape)
+        with ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
+            starts = [i * FRAME_COUNT // NUM_THREADS for i in range(NUM_THREADS + 1)]
+            list(executor.map(partial(download_frames, frames), starts[:-1], starts[1:]))
+        print(f"Frames download time: {time.time() - t0:.2f}s")
+
+        print(f"Creating GIF with {NUM_PROCESSES} processes...")
+        t0 = time.time()
+        encode_time, write_time = create_gif(arena, frames, FILE_NAME)
+        print(f"Frames encode time: {encode_time:.2f}s (summed over workers)")
+        print(f"GIF write time: {write_time:.2f}s")
+        print(f"GIF creation time: {time.time() - t0:.2f}s")
+    finally:
+        frames = None  # the arena cannot be closed while a view of it is alive
+        arena.close()
+        arena.unlink()
@@ -4,8 +4,15 @@
 # Note: Since the creation of the GIF is CPU intensive, we will use multiple processes to create the GIF.
 # On the other hand, the downloading of the frames is I/O intensive, so we will use multiple threads to download the frames.
 
+import argparse
+import asyncio
+import json
+import signal
 import socket
+import struct
 import threading
+from collections import OrderedDict
+from multiprocessing import Pool
 from PIL import Image
 import io
 import random
@@ -13,29 +20,200 @@ import random
 SERVER_IP = '0.0.0.0'
 SERVER_PORT = 1234
 BUFFER_SIZE = 1024
+MAX_CONNECTIONS = 100  # connections served at once in asyncio mode, the rest wait for a slot
+SHUTDOWN_GRACE = 5  # seconds in-flight connections get to finish on shutdown (asyncio mode)
+FRAME_POOL_SIZE = 1000  # distinct frames encoded at startup, 0 renders a new frame for every request
+CACHE_BYTES = 4 * 1024 * 1024  # upper bound for the encoded frames kept in memory
 
+# Framed protocol: the client sends any number of requests (frame id) without waiting,
+# the server answers each one in order with the PNG length followed by the PNG bytes.
+REQUEST = struct.Struct('!I')
+RESPONSE_HEADER = struct.Struct('!I')
+STATS_REQUEST = 0xFFFFFFFF  # frame id answered with the frame cache counters (JSON) instead of a PNG
 
-def handle_client(client_socket, client_addr):
-    print(f"Sending image to {client_addr}")
-    # Create a random 10x10 image
-    img = Image.new('RGB', (10, 10), color=(random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)))
+
+class FrameCache:
+    """Size-bounded LRU of encoded PNG frames keyed by color, shared by all connections"""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.frames = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, color):
+        with self.lock:
+            png = self.frames.get(color)
+            if png is None:
+                self.misses += 1
+                return None
+            self.frames.move_to_end(color)
+            self.hits += 1
+            return png
+
+    def put(self, color, png):
+        with self.lock:
+            if color in self.frames or len(png) > self.max_bytes:
+                return
+            self.frames[color] = png
+            self.size += len(png)
+            while self.size > self.max_bytes:
+                _, evicted = self.frames.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'frames': len(self.frames),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0,
+            }
+
+
+cache = FrameCache(CACHE_BYTES)
+colors = []  # the frame pool, filled by prerender_frames()
+
+
+def recv_exactly(sock, size):
+    # Returns exactly `size` bytes, or None if the peer closed the connection before sending any
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            if received == 0:
+                return None
+            raise ConnectionError("Connection closed in the middle of a message")
+        received += n
+    return buffer
+
+
+def random_color():
+    return random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)
+
+
+def render_frame(color=None):
+    # Create a 10x10 image, of a random color unless one is given
+    img = Image.new('RGB', (10, 10), color=color or random_color())
     # Convert the image to bytes
     img_bytes = io.BytesIO()
     img.save(img_bytes, format='PNG')
-    img_bytes = img_bytes.getvalue()
-    # Send the image to the client
-    client_socket.sendall(img_bytes)
-    # Close the client socket
-    client_socket.close()
+    return img_bytes.getvalue()
+
+
+def prerender_frames(pool_size, processes):
+    # Encodes the frame pool once at startup, across `processes` worker processes if more than one
+    pool_colors = [random_color() for _ in range(pool_size)]
+    if processes > 1:
+        with Pool(processes=processes) as pool:
+            pngs = pool.map(render_frame, pool_colors, chunksize=max(1, pool_size // (4 * processes)))
+    else:
+        pngs = [render_frame(color) for color in pool_colors]
+    for color, png in zip(pool_colors, pngs):
+        cache.put(color, png)
+    colors.extend(pool_colors)
+
+
+def get_frame(frame_id):
+    # Picks a random frame of the pool and serves its cached PNG, encoding it again only if it was evicted
+    if frame_id == STATS_REQUEST:
+        return json.dumps(cache.stats()).encode()
+    if not colors:
+        return render_frame()
+    color = random.choice(colors)
+    png = cache.get(color)
+    if png is None:
+        png = render_frame(color)
+        cache.put(color, png)
+    return png
 
 
-def server():
+def handle_client(client_socket, client_addr):
+    print(f"Serving frames to {client_addr}")
+    frames_sent = 0
+    with client_socket:
+        while True:
+            request = recv_exactly(client_socket, REQUEST.size)
+            if request is None:
+                break
+            frame_id, = REQUEST.unpack(request)
+            img_bytes = get_frame(frame_id)
+            # Send the length-prefixed image to the client
+            client_socket.sendall(RESPONSE_HEADER.pack(len(img_bytes)) + img_bytes)
+            frames_sent += 1
+    print(f"Sent {frames_sent} frames to {client_addr}")
+
+
+async def handle_client_async(reader, writer, slots):
+    client_addr = writer.get_extra_info('peername')
+    frames_sent = 0
+    try:
+        async with slots:
+            print(f"Serving frames to {client_addr}")
+            while True:
+                try:
+                    frame_id, = REQUEST.unpack(await reader.readexactly(REQUEST.size))
+                except asyncio.IncompleteReadError:
+                    break
+                img_bytes = get_frame(frame_id)
+                writer.write(RESPONSE_HEADER.pack(len(img_bytes)))
+                writer.write(img_bytes)
+                # Backpressure: stop reading requests while the client is not reading responses
+                await writer.drain()
+                frames_sent += 1
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+        print(f"Sent {frames_sent} frames to {client_addr}")
+
+
+async def async_server(port):
+    # One event loop serves every connection; at most MAX_CONNECTIONS are served at once
+    slots = asyncio.Semaphore(MAX_CONNECTIONS)
+    connections = set()
+
+    def on_connect(reader, writer):
+        task = asyncio.ensure_future(handle_client_async(reader, writer, slots))
+        connections.add(task)
+        task.add_done_callback(connections.discard)
+
+    server_socket = await asyncio.start_server(on_connect, SERVER_IP, port, reuse_address=True)
+    print(f"Listening on {SERVER_IP}:{port} (asyncio)")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    # Graceful shutdown: stop accepting, let in-flight connections finish, then cancel the rest
+    print("Shutting down server.")
+    server_socket.close()
+    await server_socket.wait_closed()
+    if connections:
+        done, pending = await asyncio.wait(connections, timeout=SHUTDOWN_GRACE)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    print(f"Frame cache: {cache.stats()}")
+
+
+def server(port=SERVER_PORT):
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind((SERVER_IP, SERVER_PORT))
+    server_socket.bind((SERVER_IP, port))
     server_socket.listen()
 
-    print(f"Listening on {SERVER_IP}:{SERVER_PORT}")
+    print(f"Listening on {SERVER_IP}:{port}")
     try:
         while True:
             # Accept a client connection
@@ -45,9 +223,28 @@ def server():
             t.start()
     except KeyboardInterrupt:
         print("Shutting down server.")
+        print(f"Frame cache: {cache.stats()}")
     finally:
         server_socket.close()
 
 
 if __name__ == '__main__':
-    server()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=['threaded', 'asyncio'], default='threaded',
+                        help='thread per connection, or a single asyncio event loop')
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--frame-pool', type=int, default=FRAME_POOL_SIZE,
+                        help='number of distinct frames encoded at startup (0 disables the cache)')
+    parser.add_argument('--cache-bytes', type=int, default=CACHE_BYTES, help='size bound of the frame cache')
+    parser.add_argument('--prerender-processes', type=int, default=1,
+                        help='processes used to encode the frame pool at startup')
+    args = parser.parse_args()
+
+    cache.max_bytes = args.cache_bytes
+    prerender_frames(args.frame_pool, args.prerender_processes)
+    print(f"Frame cache: {cache.stats()}")
+
+    if args.mode == 'asyncio':
+        asyncio.run(async_server(args.port))
+    else:
+        server(args.port)
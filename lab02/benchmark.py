@@ -0,0 +1,94 @@
+# Author: Abu Huraira
+# Email: a.huraira@innopolis.university
+
+# Compares the threaded and the asyncio modes of AbuHuraira_server.py: every client opens one
+# connection and sends requests one after another, so the latency of each request can be measured.
+
+import argparse
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import time
+from threading import Thread
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'AbuHuraira_server.py')
+SERVER_PORT = 1240
+CLIENTS = 200
+REQUESTS_PER_CLIENT = 50
+
+REQUEST = struct.Struct('!I')
+RESPONSE_HEADER = struct.Struct('!I')
+
+
+def recv_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError("Server closed the connection in the middle of a frame")
+        received += n
+    return buffer
+
+
+def start_server(mode, port):
+    process = subprocess.Popen([sys.executable, SERVER_SCRIPT, '--mode', mode, '--port', str(port)],
+                               stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return process
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def run_client(port, requests, latencies):
+    with socket.create_connection(('127.0.0.1', port)) as s:
+        for i in range(requests):
+            t0 = time.perf_counter()
+            s.sendall(REQUEST.pack(i))
+            length, = RESPONSE_HEADER.unpack(recv_exactly(s, RESPONSE_HEADER.size))
+            recv_exactly(s, length)
+            latencies.append(time.perf_counter() - t0)
+
+
+def benchmark(mode, port, clients, requests):
+    process = start_server(mode, port)
+    try:
+        latencies = []
+        threads = [Thread(target=run_client, args=(port, requests, latencies)) for _ in range(clients)]
+        t0 = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - t0
+    finally:
+        process.send_signal(signal.SIGINT)
+        process.wait()
+
+    latencies.sort()
+    return {
+        'requests/s': len(latencies) / elapsed,
+        'p50 ms': latencies[len(latencies) // 2] * 1000,
+        'p99 ms': latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=CLIENTS)
+    parser.add_argument('--requests', type=int, default=REQUESTS_PER_CLIENT, help='requests per client')
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    args = parser.parse_args()
+
+    print(f"{args.clients} clients x {args.requests} requests")
+    for mode in ['threaded', 'asyncio']:
+        result = benchmark(mode, args.port, args.clients, args.requests)
+        print(f"{mode:>9}: " + ', '.join(f"{key} = {value:.1f}" for key, value in result.items()))
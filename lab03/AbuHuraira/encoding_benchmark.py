@@ -0,0 +1,41 @@
+# Author: Abu Huraira
+# Email: a.huraira@innopolis.university
+
+# Encode/decode cost and bytes on the wire of the sensor reading formats in readings.py
+
+import argparse
+import time
+from readings import FORMATS, decode, encode
+
+READINGS = 100000
+SENSOR = 'co2_sensor_1'
+
+
+def measure(content_type, count, sensor):
+    timestamp = time.time_ns()
+    t0 = time.perf_counter()
+    bodies = [encode(400 + i % 1600, sensor, content_type, timestamp + i) for i in range(count)]
+    encode_time = time.perf_counter() - t0
+    bodies = [body.encode() if isinstance(body, str) else body for body in bodies]  # as received from pika
+    t0 = time.perf_counter()
+    for body in bodies:
+        decode(body, content_type)
+    decode_time = time.perf_counter() - t0
+    return {
+        'encode us': encode_time / count * 10 ** 6,
+        'decode us': decode_time / count * 10 ** 6,
+        'bytes': sum(map(len, bodies)) / count,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--readings', type=int, default=READINGS)
+    args = parser.parse_args()
+
+    print(f"{args.readings} readings")
+    for name, content_type in FORMATS.items():
+        for sensor in (None, SENSOR):
+            result = measure(content_type, args.readings, sensor)
+            label = f"{name}{', with sensor id' if sensor else ''}"
+            print(f"{label:>24}: " + ', '.join(f"{key} = {value:.2f}" for key, value in result.items()))
@@ -0,0 +1,123 @@
+# Author: Abu Huraira
+# Email: a.huraira@innopolis.university
+
+# End-to-end run of the lab03 pipeline in one process: the sensor load generator publishes readings,
+# the receiver stores them and the reporter answers control tower queries. By default everything
+# goes through the in-process broker stand-in (subscribers/localbroker.py), so the whole pipeline can be
+# measured and profiled without RabbitMQ; --broker rabbitmq runs the same thing against a real broker.
+
+import argparse
+import contextlib
+import logging
+import os
+import sys
+import tempfile
+import time
+from threading import Thread
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(HERE, 'publishers'), os.path.join(HERE, 'subscribers')]
+
+import pika
+import receiver
+import reporter
+import sensor
+from consumer import BATCH_SIZE, PREFETCH, WORKERS
+from localbroker import LocalBroker
+from readings import FORMATS
+
+READINGS = 20000
+QUERIES = 1000
+
+
+def run_subscriber(module, connect, parameters, args):
+    connection = connect(parameters)
+    channel = module.subscribe(connection, args)
+    thread = Thread(target=channel.start_consuming, daemon=True)
+    thread.start()
+    return connection, channel, thread
+
+
+def publish_readings(connect_select, parameters, count, args):
+    # Seconds until every reading is confirmed by the broker and until the receiver stored all of them
+    publisher = sensor.SensorPublisher(parameters, args.publish_batch, args.flush_interval,
+                                       connection_factory=connect_select, content_type=FORMATS[args.format])
+    t0 = time.perf_counter()
+    for i in range(count):
+        sensor.send_sensor_data(publisher, 400 + i % 1600)
+    publisher.close()
+    confirmed = time.perf_counter() - t0
+    while receiver.store.totals()['count'] < count:
+        time.sleep(0.001)
+    return confirmed, time.perf_counter() - t0
+
+
+def query_latencies(connect, parameters, count):
+    # Control tower side: rep.average queries, each waiting for its reply on an exclusive queue
+    connection = connect(parameters)
+    channel = connection.channel()
+    reply_queue = channel.queue_declare(queue='', exclusive=True).method.queue
+    channel.queue_bind(exchange=reporter.EXCHANGE_NAME, queue=reply_queue, routing_key=reply_queue)
+    replies = []
+    channel.basic_consume(queue=reply_queue, on_message_callback=lambda *message: replies.append(message[3]),
+                          auto_ack=True)
+    properties = pika.BasicProperties(reply_to=reply_queue)
+    latencies = []
+    for _ in range(count):
+        t0 = time.perf_counter()
+        channel.basic_publish(exchange=reporter.EXCHANGE_NAME, routing_key='rep.average', body=b'',
+                              properties=properties)
+        while not replies:
+            connection.process_data_events(time_limit=0.01)
+        latencies.append(time.perf_counter() - t0)
+        replies.clear()
+    connection.close()
+    latencies.sort()
+    return latencies
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--broker', choices=['local', 'rabbitmq'], default='local')
+    parser.add_argument('--readings', type=int, default=READINGS)
+    parser.add_argument('--queries', type=int, default=QUERIES)
+    parser.add_argument('--format', choices=FORMATS, default='json', help='wire format of the readings')
+    parser.add_argument('--publish-batch', type=int, default=sensor.BATCH_SIZE)
+    parser.add_argument('--flush-interval', type=float, default=sensor.FLUSH_INTERVAL)
+    parser.add_argument('--batch', action='store_true', help='subscribers consume with manual batched acks')
+    parser.add_argument('--prefetch', type=int, default=PREFETCH)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    args = parser.parse_args()
+
+    if args.broker == 'local':
+        broker = LocalBroker()
+        parameters = None
+        connect, connect_select = broker.blocking_connection, broker.select_connection
+    else:
+        credentials = pika.PlainCredentials(sensor.RMQ_USER, sensor.RMQ_PASS)
+        parameters = pika.ConnectionParameters(sensor.RMQ_HOST, credentials=credentials)
+        connect, connect_select = pika.BlockingConnection, pika.SelectConnection
+    logging.getLogger().setLevel(logging.WARNING)  # the reporter logs every query
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)  # the stores are created in the working directory
+        receiver.open_stores()
+        reporter.open_stores()
+        subscribers = [run_subscriber(module, connect, parameters, args) for module in (receiver, reporter)]
+
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):  # the receiver prints every reading
+            confirmed, stored = publish_readings(connect_select, parameters, args.readings, args)
+        latencies = query_latencies(connect, parameters, args.queries)
+
+        for connection, channel, thread in subscribers:
+            connection.add_callback_threadsafe(channel.stop_consuming)
+            thread.join()
+            connection.close()
+        os.chdir(HERE)
+
+    print(f"{args.readings} readings through the {args.broker} broker")
+    print(f"  published and confirmed: {args.readings / confirmed:.0f} readings/s")
+    print(f"  stored by the receiver:  {args.readings / stored:.0f} readings/s")
+    print(f"{args.queries} rep.average queries: p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms")
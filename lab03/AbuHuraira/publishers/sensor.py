@@ -1,45 +1,207 @@
 # Author: Abu Huraira
 # Email: a.huraira@innopolis.university
 
-import json
-from datetime import datetime
+import argparse
+import os
+import sys
+import time
+from itertools import takewhile
+from threading import Event, Lock, Semaphore, Thread
 import pika
+from pika.exchange_type import ExchangeType
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from readings import FORMATS, JSON, encode
 
 RMQ_HOST = 'localhost'
 RMQ_USER = 'rabbit'
 RMQ_PASS = '1234'
 EXCHANGE_NAME = 'amq.topic'
 ROUTING_KEY = 'co2.sensor'
+QUEUE_NAME = 'co2'
+BATCH_SIZE = 100  # buffered readings that trigger a flush
+FLUSH_INTERVAL = 0.2  # seconds a reading may wait in the buffer
+MAX_PENDING = 10000  # buffered plus unconfirmed readings before publish() blocks
 
-def send_sensor_data(co2_level):
-    # Create a connection and channel to RabbitMQ
-    credentials = pika.PlainCredentials(RMQ_USER, RMQ_PASS)
-    parameters = pika.ConnectionParameters(RMQ_HOST, credentials=credentials)
-    connection = pika.BlockingConnection(parameters)
-    channel = connection.channel()
 
-    # Declare the exchange and queue
-    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type=ExchangeType.topic)
-    channel.queue_declare(queue='co2', durable=True)
-    channel.queue_bind(exchange=EXCHANGE_NAME, queue='co2', routing_key='co2.*')
+class SensorPublisher:
+    """Long-lived publisher: one connection and channel for the lifetime of the sensor, the topology is
+    declared once, readings are buffered and published in batches and publisher confirms are tracked
+    asynchronously by delivery tag, so the broker can acknowledge many messages with one frame.
+
+    pika's BlockingChannel waits for the confirm of every single publish, so the connection runs on its
+    own I/O loop thread and the sensor only hands readings over."""
+    def __init__(self, parameters, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 connection_factory=pika.SelectConnection, content_type=JSON):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.content_type = content_type
+        self.buffer = []
+        self.lock = Lock()
+        self.pending = Semaphore(MAX_PENDING)
+        self.unconfirmed = {}  # delivery tag -> body, in publishing order
+        self.next_tag = 1
+        self.confirmed = 0
+        self.nacked = 0
+        self.channel = None
+        self.error = None
+        self.ready = Event()
+        self.drained = Event()
+        self.connection = connection_factory(parameters,
+                                             on_open_callback=self.on_connection_open,
+                                             on_open_error_callback=self.on_connection_error,
+                                             on_close_callback=self.on_connection_closed)
+        self.thread = Thread(target=self.connection.ioloop.start, daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        if self.error is not None:
+            raise ConnectionError(f"Cannot connect to RabbitMQ: {self.error!r}")
+
+    # Topology, declared once per connection
+
+    def on_connection_open(self, connection):
+        connection.channel(on_open_callback=self.on_channel_open)
+
+    def on_connection_error(self, connection, error):
+        self.error = error
+        self.ready.set()
+        connection.ioloop.stop()
+
+    def on_connection_closed(self, connection, reason):
+        self.error = reason
+        self.ready.set()
+        self.drained.set()
+        # Wakes every publish() blocked on a full buffer, they raise instead of waiting for confirms
+        for _ in range(MAX_PENDING):
+            self.pending.release()
+        connection.ioloop.stop()
+
+    def on_channel_open(self, channel):
+        self.channel = channel
+        channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type=ExchangeType.topic, durable=True,
+                                 callback=lambda _: channel.queue_declare(QUEUE_NAME, durable=True,
+                                                                          callback=self.on_queue_declared))
+
+    def on_queue_declared(self, _):
+        self.channel.queue_bind(QUEUE_NAME, EXCHANGE_NAME, routing_key='co2.*', callback=self.on_bound)
+
+    def on_bound(self, _):
+        self.channel.confirm_delivery(ack_nack_callback=self.on_delivery_confirmation)
+        self.connection.ioloop.call_later(self.flush_interval, self.on_flush_timer)
+        self.ready.set()
+
+    # Publishing, on the I/O loop thread
+
+    def flush(self):
+        with self.lock:
+            batch, self.buffer = self.buffer, []
+        properties = pika.BasicProperties(content_type=self.content_type)
+        for body in batch:
+            self.channel.basic_publish(exchange=EXCHANGE_NAME, routing_key=ROUTING_KEY, body=body,
+                                       properties=properties)
+            self.unconfirmed[self.next_tag] = body
+            self.next_tag += 1
+        self.check_drained()
 
-    # Create a JSON payload
-    data = {
-        'time': str(datetime.now()),
-        'value': co2_level,
-    }
-    payload = json.dumps(data)
+    def on_flush_timer(self):
+        self.flush()
+        self.connection.ioloop.call_later(self.flush_interval, self.on_flush_timer)
 
-    # Publish the payload to the queue
-    channel.basic_publish(exchange=EXCHANGE_NAME, routing_key=ROUTING_KEY, body=payload)
+    def on_delivery_confirmation(self, frame):
+        # With multiple set, one ack or nack covers every delivery tag up to and including this one
+        method = frame.method
+        if method.multiple:
+            tags = list(takewhile(lambda tag: tag <= method.delivery_tag, self.unconfirmed))
+        else:
+            tags = [method.delivery_tag]
+        bodies = [self.unconfirmed.pop(tag) for tag in tags if tag in self.unconfirmed]
+        if isinstance(method, pika.spec.Basic.Ack):
+            self.confirmed += len(bodies)
+            for _ in bodies:
+                self.pending.release()
+        else:
+            # The broker could not take them, publish them again with the next batch
+            self.nacked += len(bodies)
+            with self.lock:
+                self.buffer[:0] = bodies
+        self.check_drained()
+
+    def check_drained(self):
+        with self.lock:
+            if not self.unconfirmed and not self.buffer:
+                self.drained.set()
+
+    # Sensor side, any thread
+
+    def publish(self, body):
+        # Raises ConnectionError once the connection is closed, buffered and unconfirmed readings are lost
+        self.check_connection()
+        self.pending.acquire()
+        self.check_connection()
+        with self.lock:
+            self.drained.clear()
+            self.buffer.append(body)
+            full = len(self.buffer) >= self.batch_size
+        if full:
+            self.connection.ioloop.add_callback_threadsafe(self.flush)
+
+    def check_connection(self):
+        if self.error is not None:
+            raise ConnectionError(f"Connection to RabbitMQ closed: {self.error!r}, "
+                                  f"{len(self.unconfirmed) + len(self.buffer)} readings not confirmed")
+
+    def close(self):
+        # Flushes the buffer, waits until every reading is confirmed and closes the connection
+        if self.error is None:
+            self.connection.ioloop.add_callback_threadsafe(self.flush)
+            self.drained.wait()
+            if self.error is None:
+                self.connection.ioloop.add_callback_threadsafe(self.connection.close)
+        self.thread.join()
+
+
+def send_sensor_data(publisher, co2_level):
+    publisher.publish(encode(co2_level, content_type=publisher.content_type))
+
+
+def generate_load(publisher, count, rate):
+    # Load generator: `count` readings at `rate` readings per second, as fast as possible if rate is 0
+    t0 = time.time()
+    for i in range(count):
+        if rate:
+            delay = t0 + i / rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        send_sensor_data(publisher, 400 + i % 1600)
+    publisher.close()
+    elapsed = time.time() - t0
+    print(f"Published {count} readings in {elapsed:.2f}s ({count / elapsed:.0f} readings/s), "
+          f"{publisher.confirmed} confirmed, {publisher.nacked} nacked and republished")
 
-    # Close the connection
-    connection.close()
 
 if __name__ == '__main__':
-    while True:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--load', type=int, default=0, help='publish this many generated readings and exit')
+    parser.add_argument('--rate', type=float, default=0, help='readings per second of the load generator, 0 is unlimited')
+    parser.add_argument('--format', choices=FORMATS, default='json', help='wire format of the readings')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--flush-interval', type=float, default=FLUSH_INTERVAL)
+    args = parser.parse_args()
+
+    credentials = pika.PlainCredentials(RMQ_USER, RMQ_PASS)
+    parameters = pika.ConnectionParameters(RMQ_HOST, credentials=credentials)
+    publisher = SensorPublisher(parameters, args.batch_size, args.flush_interval,
+                                content_type=FORMATS[args.format])
+
+    if args.load:
+        generate_load(publisher, args.load, args.rate)
+    else:
         try:
-            co2_level = int(input('Enter CO2 level: '))
-            send_sensor_data(co2_level)
-        except ValueError:
-            print('Invalid input, please enter an integer.')
+            while True:
+                try:
+                    co2_level = int(input('Enter CO2 level: '))
+                    send_sensor_data(publisher, co2_level)
+                except ValueError:
+                    print('Invalid input, please enter an integer.')
+        except (EOFError, KeyboardInterrupt):
+            publisher.close()
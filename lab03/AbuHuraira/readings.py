@@ -0,0 +1,51 @@
+# Author: Abu Huraira
+# Email: a.huraira@innopolis.university
+
+# Wire formats of the sensor readings, told apart by the content_type message property:
+#   application/json           {"time": "<datetime>", "value": <level>[, "sensor_id": <name>]}, the original format
+#   application/x-co2-reading  little-endian int64 epoch nanoseconds, float32 level, then the optional sensor name
+# The binary format is 12 bytes plus the name and decodes without any text parsing.
+# Consumers accept both, a message without content_type is JSON.
+
+import json
+import math
+import struct
+import time
+from datetime import datetime
+
+JSON = 'application/json'
+BINARY = 'application/x-co2-reading'
+FORMATS = {'json': JSON, 'binary': BINARY}
+READING = struct.Struct('<qf')
+
+
+def encode(value, sensor=None, content_type=JSON, timestamp=None):
+    # timestamp in epoch nanoseconds, now if None
+    timestamp = time.time_ns() if timestamp is None else timestamp
+    if content_type == BINARY:
+        return READING.pack(timestamp, value) + (sensor.encode() if sensor else b'')
+    data = {
+        'time': str(datetime.fromtimestamp(timestamp / 10 ** 9)),
+        'value': value,
+    }
+    if sensor:
+        data['sensor_id'] = sensor
+    return json.dumps(data)
+
+
+def decode(body, content_type=None):
+    # (epoch nanoseconds, value, sensor name or None), raises ValueError if the body is not a valid reading
+    if content_type == BINARY:
+        timestamp, value = READING.unpack_from(body)
+        sensor = body[READING.size:].decode() or None
+    else:
+        message = json.loads(body)
+        if not isinstance(message, dict) or not isinstance(message.get('time'), str):
+            raise ValueError("Reading without a time string")
+        timestamp = int(datetime.fromisoformat(message['time']).timestamp() * 10 ** 9)
+        value, sensor = message.get('value'), message.get('sensor_id')
+        if sensor is not None and not isinstance(sensor, str):
+            raise ValueError("Sensor id is not a string")
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError("Reading value is not a number")
+    return timestamp, value, sensor
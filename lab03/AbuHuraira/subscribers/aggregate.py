@@ -0,0 +1,108 @@
+# Author: Abu Huraira
+# Email: a.huraira@innopolis.university
+
+# Running aggregate of the CO2 readings, kept in a small memory-mapped file that the receiver updates
+# in O(1) per reading and the reporter reads in O(1), even right after a restart.
+#
+# Layout: sequence | count, sum, last value, last time | BUCKETS x (bucket index, count, sum, min, max)
+# The buckets form a ring covering the last WINDOW seconds. The sequence number is odd while the
+# receiver is in the middle of an update, so readers in other processes retry instead of seeing half of it.
+
+import mmap
+import os
+import struct
+import time
+
+AGGREGATE_FILE = 'co2.aggregate'
+WINDOW = 3600  # seconds covered by the windowed min/max/avg
+BUCKETS = 60  # the window is kept as this many buckets
+
+SEQUENCE = struct.Struct('<Q')
+TOTALS = struct.Struct('<Qddd')
+BUCKET = struct.Struct('<qQddd')
+TOTALS_OFFSET = SEQUENCE.size
+BUCKETS_OFFSET = TOTALS_OFFSET + TOTALS.size
+FILE_SIZE = BUCKETS_OFFSET + BUCKETS * BUCKET.size
+BUCKET_WIDTH = WINDOW / BUCKETS
+
+
+class AggregateStore:
+    def __init__(self, path=AGGREGATE_FILE, writable=False):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < FILE_SIZE:
+                os.ftruncate(fd, FILE_SIZE)  # a zeroed file is an empty aggregate
+            self.map = mmap.mmap(fd, FILE_SIZE, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        sequence, = SEQUENCE.unpack_from(self.map, 0)
+        if writable and sequence % 2:
+            # The previous receiver stopped in the middle of an update
+            SEQUENCE.pack_into(self.map, 0, sequence + 1)
+
+    def add(self, timestamp, value):
+        # The new totals and bucket are computed before the sequence turns odd, so a reading that cannot be
+        # added raises without leaving readers spinning on a half-written update
+        count, total, last, last_time = TOTALS.unpack_from(self.map, TOTALS_OFFSET)
+        if timestamp >= last_time:
+            last, last_time = value, timestamp
+        totals = TOTALS.pack(count + 1, total + value, last, last_time)
+
+        index = int(timestamp // BUCKET_WIDTH)
+        offset = BUCKETS_OFFSET + index % BUCKETS * BUCKET.size
+        bucket_index, count, total, low, high = BUCKET.unpack_from(self.map, offset)
+        if bucket_index == index and count:
+            bucket = BUCKET.pack(index, count + 1, total + value, min(low, value), max(high, value))
+        elif bucket_index < index or not count:
+            # The slot still holds a bucket that fell out of the window
+            bucket = BUCKET.pack(index, 1, value, value, value)
+        else:
+            bucket = None  # the reading is older than the window, it only counts towards the totals
+
+        sequence, = SEQUENCE.unpack_from(self.map, 0)
+        SEQUENCE.pack_into(self.map, 0, sequence + 1)
+        try:
+            self.map[TOTALS_OFFSET:TOTALS_OFFSET + TOTALS.size] = totals
+            if bucket is not None:
+                self.map[offset:offset + BUCKET.size] = bucket
+        finally:
+            SEQUENCE.pack_into(self.map, 0, sequence + 2)
+
+    def read(self):
+        # Consistent copy of the whole aggregate
+        while True:
+            before, = SEQUENCE.unpack_from(self.map, 0)
+            if before % 2 == 0:
+                data = self.map[:FILE_SIZE]
+                after, = SEQUENCE.unpack_from(self.map, 0)
+                if before == after:
+                    return data
+            time.sleep(0)
+
+    def totals(self):
+        count, total, last, last_time = TOTALS.unpack_from(self.read(), TOTALS_OFFSET)
+        return {
+            'count': count,
+            'average': total / count if count else 0,
+            'last': last,
+            'last_time': last_time,
+        }
+
+    def window(self, now=None):
+        # min/max/avg over the buckets of the last WINDOW seconds
+        data = self.read()
+        first = int((time.time() if now is None else now) // BUCKET_WIDTH) - BUCKETS + 1
+        count, total, low, high = 0, 0.0, float('inf'), float('-inf')
+        for bucket_index, n, bucket_total, bucket_low, bucket_high in \
+                BUCKET.iter_unpack(data[BUCKETS_OFFSET:FILE_SIZE]):
+            if n and bucket_index >= first:
+                count += n
+                total += bucket_total
+                low = min(low, bucket_low)
+                high = max(high, bucket_high)
+        if not count:
+            return {'count': 0, 'min': None, 'max': None, 'average': None}
+        return {'count': count, 'min': low, 'max': high, 'average': total / count}
+
+    def close(self):
+        self.map.close()
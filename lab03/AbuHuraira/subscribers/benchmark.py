@@ -0,0 +1,103 @@
+# Author: Abu Huraira
+# Email: a.huraira@innopolis.university
+
+# Consumer throughput: fills a queue with sensor readings and drains it once with the per-message
+# auto-ack callback the subscribers use by default and once per batch consumer configuration.
+# Every message is decoded and added to an aggregate store, like the receiver does.
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+from threading import Lock
+from pika import BlockingConnection, ConnectionParameters, PlainCredentials
+from aggregate import AggregateStore
+from consumer import BATCH_SIZE, PREFETCH, BatchConsumer
+from localbroker import LocalBroker
+
+RMQ_HOST = 'localhost'
+RMQ_USER = 'rabbit'
+RMQ_PASS = '1234'
+QUEUE_NAME = 'co2.benchmark'
+MESSAGES = 20000
+
+
+def fill_queue(channel, count):
+    channel.queue_declare(queue=QUEUE_NAME, auto_delete=False)
+    channel.queue_purge(queue=QUEUE_NAME)
+    for i in range(count):
+        body = json.dumps({'time': str(datetime.now()), 'value': 400 + i % 1600})
+        channel.basic_publish(exchange='', routing_key=QUEUE_NAME, body=body)
+
+
+def drain(connection, channel, count, store, batch=None):
+    # Seconds to consume `count` messages, per message with auto-ack or with a BatchConsumer(**batch)
+    lock = Lock()
+    consumed = 0
+
+    def handle(body):
+        message = json.loads(body)
+        store.add(datetime.fromisoformat(message['time']).timestamp(), message['value'])
+
+    def callback(channel, method, properties, body):
+        nonlocal consumed
+        handle(body)
+        consumed += 1
+        if consumed == count:
+            channel.stop_consuming()
+
+    def handle_batch(messages):
+        nonlocal consumed
+        with lock:
+            for _, _, body in messages:
+                handle(body)
+            consumed += len(messages)
+            if consumed == count:
+                connection.add_callback_threadsafe(channel.stop_consuming)
+
+    t0 = time.perf_counter()
+    if batch is None:
+        channel.basic_consume(queue=QUEUE_NAME, on_message_callback=callback, auto_ack=True)
+        channel.start_consuming()
+    else:
+        consumer = BatchConsumer(connection, channel, QUEUE_NAME, handle_batch, **batch)
+        channel.start_consuming()
+        consumer.close()
+    return time.perf_counter() - t0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--broker', choices=['rabbitmq', 'local'], default='rabbitmq',
+                        help='local runs against the in-process broker stand-in')
+    parser.add_argument('--messages', type=int, default=MESSAGES)
+    parser.add_argument('--prefetch', type=int, default=PREFETCH)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    if args.broker == 'local':
+        parameters = None
+        connect = LocalBroker().blocking_connection
+    else:
+        credentials = PlainCredentials(RMQ_USER, RMQ_PASS)
+        parameters = ConnectionParameters(RMQ_HOST, credentials=credentials)
+        connect = BlockingConnection
+    configurations = {
+        'callback, auto-ack': None,
+        'batch': {'prefetch': args.prefetch, 'batch_size': args.batch_size},
+        'batch, 4 workers': {'prefetch': args.prefetch, 'batch_size': args.batch_size, 'workers': 4},
+    }
+
+    print(f"{args.messages} messages, prefetch {args.prefetch}, batch size {args.batch_size}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, batch in configurations.items():
+            connection = connect(parameters)
+            channel = connection.channel()
+            fill_queue(channel, args.messages)
+            store = AggregateStore(os.path.join(directory, name), writable=True)
+            elapsed = drain(connection, channel, args.messages, store, batch)
+            store.close()
+            connection.close()
+            print(f"{name:>20}: {args.messages / elapsed:.0f} messages/s")
@@ -0,0 +1,83 @@
+# Author: Abu Huraira
+# Email: a.huraira@innopolis.university
+
+# Batch consumer shared by the subscribers: basic_qos bounds how many unacknowledged messages the broker
+# pushes ahead, deliveries are collected into batches, every batch is handled with one call (on the
+# connection thread or on a worker pool) and acknowledged with a single multiple-ack.
+# The prefetch should be larger than the batch size, otherwise batches are only closed by the flush timer.
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+PREFETCH = 1000  # unacknowledged messages the broker may push ahead
+BATCH_SIZE = 200  # messages handled and acknowledged together
+FLUSH_INTERVAL = 0.05  # seconds before a partial batch is handled anyway
+WORKERS = 0  # threads handling batches, 0 handles them on the connection thread
+
+
+class BatchConsumer:
+    """`handle_batch` gets a list of (method, properties, body) and may return (routing key, body) replies,
+    they are published on the connection thread right before the batch is acknowledged"""
+    def __init__(self, connection, channel, queue, handle_batch, reply_exchange='', prefetch=PREFETCH,
+                 batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, workers=WORKERS):
+        self.connection = connection
+        self.channel = channel
+        self.handle_batch = handle_batch
+        self.reply_exchange = reply_exchange
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pool = ThreadPoolExecutor(max_workers=workers) if workers else None
+        self.batch = []
+        self.in_flight = deque()  # (future, last delivery tag) of the batches on the pool, in delivery order
+        self.timer = None
+        channel.basic_qos(prefetch_count=prefetch)
+        self.consumer_tag = channel.basic_consume(queue=queue, on_message_callback=self.on_message, auto_ack=False)
+
+    def on_message(self, channel, method, properties, body):
+        self.batch.append((method, properties, body))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.connection.call_later(self.flush_interval, self.on_timer)
+
+    def on_timer(self):
+        self.timer = None
+        self.flush()
+
+    def flush(self):
+        if self.timer is not None:
+            self.connection.remove_timeout(self.timer)
+            self.timer = None
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        last_tag = batch[-1][0].delivery_tag
+        if self.pool is None:
+            self.finish(self.handle_batch(batch), last_tag)
+        else:
+            future = self.pool.submit(self.handle_batch, batch)
+            self.in_flight.append((future, last_tag))
+            future.add_done_callback(lambda _: self.connection.add_callback_threadsafe(self.ack_completed))
+
+    def ack_completed(self):
+        # Batches complete in any order, but a multiple-ack covers every delivery before it,
+        # so only the completed prefix of the in-flight batches is acknowledged
+        replies = []
+        last_tag = None
+        while self.in_flight and self.in_flight[0][0].done():
+            future, last_tag = self.in_flight.popleft()
+            replies.extend(future.result() or ())
+        if last_tag is not None:
+            self.finish(replies, last_tag)
+
+    def finish(self, replies, last_tag):
+        for routing_key, body in replies or ():
+            self.channel.basic_publish(exchange=self.reply_exchange, routing_key=routing_key, body=body)
+        self.channel.basic_ack(delivery_tag=last_tag, multiple=True)
+
+    def close(self):
+        # Handles what is left and waits for the workers, for use after start_consuming returns
+        self.flush()
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.ack_completed()
@@ -0,0 +1,372 @@
+# Author: Abu Huraira
+# Email: a.huraira@innopolis.university
+
+# In-process stand-in for RabbitMQ, so the lab03 pipeline can run and be profiled on one machine.
+# It implements the part of pika the scripts use: BlockingConnection and SelectConnection with
+# exchange/queue declaration and binding, basic_publish, basic_consume with basic_qos prefetch and
+# (multiple) acks, publisher confirms and reply_to. Topic exchanges route through a trie of the
+# binding patterns, the default exchange routes to the queue named by the routing key.
+#
+# Every connection has an event loop that runs on the thread consuming from it (start_consuming,
+# process_data_events or ioloop.start), deliveries and confirms are queued onto it from any thread.
+
+import heapq
+import itertools
+import time
+from collections import deque
+from threading import Condition, Lock
+from pika import BasicProperties
+from pika.exceptions import ConnectionClosedByClient
+from pika.frame import Method
+from pika.spec import Basic, Exchange, Queue
+
+MATCH_CACHE = 1024  # routing keys whose matching queues are remembered
+
+
+class TopicTrie:
+    """Binding patterns split into words, '*' matches exactly one word and '#' zero or more"""
+    def __init__(self):
+        self.root = {}  # word -> child node, the None key holds the queues bound at this node
+        self.cache = {}
+
+    def bind(self, pattern, queue):
+        node = self.root
+        for word in pattern.split('.'):
+            node = node.setdefault(word, {})
+        node.setdefault(None, set()).add(queue)
+        self.cache.clear()
+
+    def unbind_queue(self, queue, node=None):
+        node = self.root if node is None else node
+        node.get(None, set()).discard(queue)
+        for word, child in node.items():
+            if word is not None:
+                self.unbind_queue(queue, child)
+        self.cache.clear()
+
+    def match(self, routing_key):
+        queues = self.cache.get(routing_key)
+        if queues is None:
+            found = set()
+            self.match_node(self.root, routing_key.split('.'), 0, found)
+            if len(self.cache) >= MATCH_CACHE:
+                self.cache.clear()
+            queues = self.cache[routing_key] = tuple(found)
+        return queues
+
+    def match_node(self, node, words, i, found):
+        if i == len(words):
+            found.update(node.get(None, ()))
+        else:
+            for word in (words[i], '*'):
+                child = node.get(word)
+                if child is not None:
+                    self.match_node(child, words, i + 1, found)
+        child = node.get('#')
+        if child is not None:
+            for j in range(i, len(words) + 1):
+                self.match_node(child, words, j, found)
+
+
+class MessageQueue:
+    def __init__(self, name, exclusive_to=None):
+        self.name = name
+        self.exclusive_to = exclusive_to
+        self.messages = deque()  # (exchange, routing key, properties, body, redelivered)
+        self.consumers = deque()  # served round robin
+
+
+class Consumer:
+    def __init__(self, channel, queue, callback, auto_ack, tag):
+        self.channel = channel
+        self.queue = queue
+        self.callback = callback
+        self.auto_ack = auto_ack
+        self.tag = tag
+        self.unacked = 0
+
+    def has_credit(self):
+        prefetch = self.channel.prefetch
+        return self.auto_ack or not prefetch or self.unacked < prefetch
+
+
+class LocalBroker:
+    def __init__(self):
+        self.lock = Lock()
+        self.exchanges = {'amq.topic': TopicTrie()}
+        self.queues = {}
+        self.names = itertools.count(1)
+
+    def blocking_connection(self, parameters=None):
+        return BlockingConnection(self)
+
+    def select_connection(self, parameters=None, on_open_callback=None, on_open_error_callback=None,
+                          on_close_callback=None):
+        return SelectConnection(self, on_open_callback, on_close_callback)
+
+    def declare_queue(self, name, exclusive_to):
+        with self.lock:
+            if not name:
+                name = f'amq.gen-{next(self.names)}'
+            queue = self.queues.get(name)
+            if queue is None:
+                queue = self.queues[name] = MessageQueue(name, exclusive_to)
+            return Method(1, Queue.DeclareOk(queue=name, message_count=len(queue.messages),
+                                             consumer_count=len(queue.consumers)))
+
+    def bind(self, queue, exchange, routing_key):
+        with self.lock:
+            self.exchanges.setdefault(exchange, TopicTrie()).bind(routing_key, self.queues[queue])
+
+    def publish(self, exchange, routing_key, body, properties):
+        with self.lock:
+            if exchange:
+                queues = self.exchanges[exchange].match(routing_key)
+            else:
+                queues = (self.queues[routing_key],) if routing_key in self.queues else ()
+            for queue in queues:
+                queue.messages.append((exchange, routing_key, properties, body, False))
+                self.dispatch(queue)
+
+    def dispatch(self, queue):
+        # Hands messages to consumers with prefetch credit left, called with the lock held
+        while queue.messages and queue.consumers:
+            for _ in range(len(queue.consumers)):
+                consumer = queue.consumers[0]
+                queue.consumers.rotate(-1)
+                if consumer.has_credit():
+                    break
+            else:
+                return
+            exchange, routing_key, properties, body, redelivered = queue.messages.popleft()
+            channel = consumer.channel
+            channel.delivery_tags += 1
+            tag = channel.delivery_tags
+            if not consumer.auto_ack:
+                consumer.unacked += 1
+                channel.unacked[tag] = (consumer, (exchange, routing_key, properties, body, True))
+            method = Basic.Deliver(consumer.tag, tag, redelivered, exchange, routing_key)
+            channel.connection.loop.add_callback_threadsafe(
+                lambda c=consumer, m=method, p=properties, b=body: c.callback(c.channel, m, p, b))
+
+    def ack(self, channel, delivery_tag, multiple, requeue=False):
+        with self.lock:
+            if multiple:
+                tags = list(itertools.takewhile(lambda tag: tag <= delivery_tag, channel.unacked))
+            else:
+                tags = [delivery_tag]
+            queues = set()
+            for tag in reversed(tags) if requeue else tags:
+                consumer, message = channel.unacked.pop(tag)
+                consumer.unacked -= 1
+                if requeue:
+                    consumer.queue.messages.appendleft(message)
+                queues.add(consumer.queue)
+            for queue in queues:
+                self.dispatch(queue)
+
+    def consume(self, consumer):
+        with self.lock:
+            consumer.queue.consumers.append(consumer)
+            self.dispatch(consumer.queue)
+
+    def cancel(self, consumer):
+        with self.lock:
+            if consumer in consumer.queue.consumers:
+                consumer.queue.consumers.remove(consumer)
+
+    def purge(self, queue):
+        with self.lock:
+            count = len(self.queues[queue].messages)
+            self.queues[queue].messages.clear()
+            return Method(1, Queue.PurgeOk(message_count=count))
+
+    def close(self, connection):
+        # Unacknowledged messages go back to their queues, exclusive queues are deleted
+        for channel in connection.channels:
+            for consumer in channel.consumers.values():
+                self.cancel(consumer)
+            if channel.unacked:
+                self.ack(channel, max(channel.unacked), multiple=True, requeue=True)
+        with self.lock:
+            for name, queue in list(self.queues.items()):
+                if queue.exclusive_to is connection:
+                    del self.queues[name]
+                    for trie in self.exchanges.values():
+                        trie.unbind_queue(queue)
+
+
+class EventLoop:
+    def __init__(self):
+        self.condition = Condition()
+        self.callbacks = deque()
+        self.timers = []  # heap of [deadline, sequence, callback]
+        self.sequence = itertools.count()
+        self.running = False
+
+    def add_callback_threadsafe(self, callback):
+        with self.condition:
+            self.callbacks.append(callback)
+            self.condition.notify()
+
+    def call_later(self, delay, callback):
+        timer = [time.monotonic() + delay, next(self.sequence), callback]
+        with self.condition:
+            heapq.heappush(self.timers, timer)
+            self.condition.notify()
+        return timer
+
+    def remove_timeout(self, timer):
+        timer[2] = None
+
+    def run_once(self, timeout=None):
+        with self.condition:
+            if not self.callbacks:
+                deadline = self.timers[0][0] - time.monotonic() if self.timers else None
+                if timeout is not None:
+                    deadline = timeout if deadline is None else min(deadline, timeout)
+                if deadline is None or deadline > 0:
+                    self.condition.wait(deadline)
+            callbacks, self.callbacks = self.callbacks, deque()
+            due = []
+            now = time.monotonic()
+            while self.timers and self.timers[0][0] <= now:
+                due.append(heapq.heappop(self.timers)[2])
+        for callback in callbacks:
+            callback()
+        for callback in due:
+            if callback is not None:
+                callback()
+
+    def start(self):
+        self.running = True
+        while self.running:
+            self.run_once()
+
+    def stop(self):
+        def stop():
+            self.running = False
+        self.add_callback_threadsafe(stop)
+
+
+class Channel:
+    def __init__(self, connection):
+        self.connection = connection
+        self.broker = connection.broker
+        self.prefetch = 0
+        self.consumers = {}
+        self.unacked = {}  # delivery tag -> (consumer, message), in delivery order
+        self.delivery_tags = 0
+        self.confirm_callback = None
+        self.published = 0
+        self.confirmed = 0
+
+    def reply(self, result, callback):
+        # Blocking channels return the result, asynchronous ones pass it to the callback on the loop
+        if callback is not None:
+            self.connection.loop.add_callback_threadsafe(lambda: callback(result))
+        return result
+
+    def exchange_declare(self, exchange, exchange_type='direct', passive=False, durable=False, auto_delete=False,
+                         internal=False, arguments=None, callback=None):
+        with self.broker.lock:
+            self.broker.exchanges.setdefault(exchange, TopicTrie())
+        return self.reply(Method(1, Exchange.DeclareOk()), callback)
+
+    def queue_declare(self, queue, passive=False, durable=False, exclusive=False, auto_delete=False,
+                      arguments=None, callback=None):
+        result = self.broker.declare_queue(queue, self.connection if exclusive else None)
+        return self.reply(result, callback)
+
+    def queue_bind(self, queue, exchange, routing_key=None, arguments=None, callback=None):
+        self.broker.bind(queue, exchange, routing_key if routing_key is not None else queue)
+        return self.reply(Method(1, Queue.BindOk()), callback)
+
+    def queue_purge(self, queue, callback=None):
+        return self.reply(self.broker.purge(queue), callback)
+
+    def basic_qos(self, prefetch_size=0, prefetch_count=0, global_qos=False, callback=None):
+        self.prefetch = prefetch_count
+        return self.reply(Method(1, Basic.QosOk()), callback)
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False, exclusive=False, consumer_tag=None,
+                      arguments=None, callback=None):
+        tag = consumer_tag or f'ctag-{len(self.consumers) + 1}'
+        consumer = self.consumers[tag] = Consumer(self, self.broker.queues[queue], on_message_callback, auto_ack, tag)
+        self.broker.consume(consumer)
+        return tag
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.broker.ack(self, delivery_tag, multiple)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        if isinstance(body, str):
+            body = body.encode()
+        self.broker.publish(exchange, routing_key, body, properties or BasicProperties())
+        if self.confirm_callback is not None:
+            # Like the broker, one multiple-ack confirms everything published before the loop runs
+            self.published += 1
+            if self.published == self.confirmed + 1:
+                self.connection.loop.add_callback_threadsafe(self.confirm)
+
+    def confirm_delivery(self, ack_nack_callback=None, callback=None):
+        self.confirm_callback = ack_nack_callback
+        return self.reply(Method(1, Basic.Ack()), callback)
+
+    def confirm(self):
+        self.confirmed = self.published
+        self.confirm_callback(Method(1, Basic.Ack(delivery_tag=self.confirmed, multiple=True)))
+
+    def start_consuming(self):
+        self.connection.loop.start()
+
+    def stop_consuming(self, consumer_tag=None):
+        for consumer in self.consumers.values():
+            self.broker.cancel(consumer)
+        self.connection.loop.stop()
+
+
+class BlockingConnection:
+    def __init__(self, broker):
+        self.broker = broker
+        self.loop = EventLoop()
+        self.channels = []
+        self.add_callback_threadsafe = self.loop.add_callback_threadsafe
+        self.call_later = self.loop.call_later
+        self.remove_timeout = self.loop.remove_timeout
+
+    def channel(self):
+        channel = Channel(self)
+        self.channels.append(channel)
+        return channel
+
+    def process_data_events(self, time_limit=0):
+        # Waits at most time_limit for events and dispatches them
+        self.loop.run_once(time_limit)
+
+    def close(self):
+        self.broker.close(self)
+
+
+class SelectConnection:
+    def __init__(self, broker, on_open_callback, on_close_callback):
+        self.broker = broker
+        self.ioloop = EventLoop()
+        self.loop = self.ioloop
+        self.channels = []
+        self.on_close_callback = on_close_callback
+        if on_open_callback is not None:
+            self.ioloop.add_callback_threadsafe(lambda: on_open_callback(self))
+
+    def channel(self, on_open_callback):
+        channel = Channel(self)
+        self.channels.append(channel)
+        self.ioloop.add_callback_threadsafe(lambda: on_open_callback(channel))
+        return channel
+
+    def close(self):
+        self.broker.close(self)
+        if self.on_close_callback is not None:
+            # Same reason as a pika connection closed by its owner
+            reason = ConnectionClosedByClient(200, 'Normal shutdown')
+            self.ioloop.add_callback_threadsafe(lambda: self.on_close_callback(self, reason))
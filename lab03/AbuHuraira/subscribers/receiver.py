@@ -1,9 +1,19 @@
 # Author: Abu Huraira
 # Email: a.huraira@innopolis.university
 
-import json
+import argparse
+import os
+import struct
+import sys
+from threading import Lock
 from pika import BlockingConnection, ConnectionParameters, PlainCredentials
 from pika.exchange_type import ExchangeType
+from aggregate import AggregateStore
+from consumer import BATCH_SIZE, PREFETCH, WORKERS, BatchConsumer
+from timeseries import TimeSeriesStore
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from readings import decode
 
 RMQ_HOST = 'localhost'
 RMQ_USER = 'rabbit'
@@ -12,25 +22,79 @@ EXCHANGE_NAME = 'amq.topic'
 ROUTING_KEY = 'co2.*'
 
 
+def record(timestamp, value, sensor):
+    # timestamp in epoch nanoseconds
+    store.add(timestamp / 10 ** 9, value)
+    history.append(timestamp, sensor, value)
+
+
+def read(body, properties):
+    # (epoch nanoseconds, value, sensor name or None), None for a co2.* message that is not a reading,
+    # e.g. the control tower's status messages
+    try:
+        return decode(body, properties.content_type)
+    except (KeyError, ValueError, TypeError, AttributeError, struct.error):
+        print('Skipped message:', body)
+        return None
+
+
 def callback(channel, method, properties, body):
-    message = json.loads(body)
+    reading = read(body, properties)
+    if reading is None:
+        return
+    timestamp, value, sensor = reading
+    record(timestamp, value, sensor or method.routing_key)
     print('Received message:')
-    print(message)
+    print({'time': timestamp, 'value': value, 'sensor_id': sensor or method.routing_key})
 
 
-if __name__ == '__main__':
-    credentials = PlainCredentials(RMQ_USER, RMQ_PASS)
-    parameters = ConnectionParameters(RMQ_HOST, credentials=credentials)
-    connection = BlockingConnection(parameters)
+def record_batch(batch):
+    # Decoding runs on the worker, the stores have a single writer. Skipped messages are acked with the batch
+    readings = [(method, read(body, properties)) for method, properties, body in batch]
+    readings = [(method, reading) for method, reading in readings if reading is not None]
+    with store_lock:
+        for method, (timestamp, value, sensor) in readings:
+            record(timestamp, value, sensor or method.routing_key)
+    print(f'Stored {len(readings)} readings')
+
+
+def open_stores():
+    global store, history, store_lock
+    store = AggregateStore(writable=True)
+    history = TimeSeriesStore(writable=True)
+    store_lock = Lock()
+
+
+def subscribe(connection, args):
     channel = connection.channel()
 
-    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type=ExchangeType.TOPIC)
+    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type=ExchangeType.topic, durable=True)
     result = channel.queue_declare(queue='', exclusive=True)
     queue_name = result.method.queue
 
     channel.queue_bind(exchange=EXCHANGE_NAME, queue=queue_name, routing_key=ROUTING_KEY)
 
-    print('Waiting for messages...')
-    channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=True)
+    if args.batch:
+        BatchConsumer(connection, channel, queue_name, record_batch, prefetch=args.prefetch,
+                      batch_size=args.batch_size, workers=args.workers)
+    else:
+        channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=True)
+    return channel
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', action='store_true', help='consume with manual batched acks')
+    parser.add_argument('--prefetch', type=int, default=PREFETCH)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    args = parser.parse_args()
 
+    open_stores()
+    credentials = PlainCredentials(RMQ_USER, RMQ_PASS)
+    parameters = ConnectionParameters(RMQ_HOST, credentials=credentials)
+    connection = BlockingConnection(parameters)
+    channel = subscribe(connection, args)
+
+    print('Waiting for messages...')
     channel.start_consuming()
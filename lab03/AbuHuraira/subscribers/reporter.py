@@ -1,46 +1,98 @@
 # Author: Abu Huraira
 # Email: a.huraira@innopolis.university
 
+import argparse
 import json
 import logging
 import sys
 import pika
+from pika import ConnectionParameters, PlainCredentials
+from pika.exchange_type import ExchangeType
+from aggregate import WINDOW, AggregateStore
+from consumer import BATCH_SIZE, PREFETCH, WORKERS, BatchConsumer
+from timeseries import TimeSeriesStore
 
 RMQ_HOST = 'localhost'
 RMQ_USER = 'rabbit'
 RMQ_PASS = '1234'
 EXCHANGE_NAME = 'amq.topic'
-ROUTING_KEYS = ['rep.current', 'rep.average']
+ROUTING_KEYS = ['rep.current', 'rep.average', 'rep.window', 'rep.history']
+HISTORY_SECONDS = 3600
+MAX_HISTORY_SECONDS = 30 * 24 * 3600  # a longer range would walk through that many empty segment slots
 RECEIVER_QUEUE = 'receiver_queue'
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
-def on_message(channel, method, properties, body):
-    logging.info(f"Received message with routing key: {method.routing_key}")
-    if method.routing_key == 'rep.current':
-        with open('receiver.log', 'r') as f:
-            lines = f.readlines()
-            last_line = lines[-1] if len(lines) > 0 else "No data received yet"
-        response = f"Latest CO2 level is {json.loads(last_line)['value']}"
-    elif method.routing_key == 'rep.average':
-        with open('receiver.log', 'r') as f:
-            lines = f.readlines()
-            values = [json.loads(line)['value'] for line in lines]
-            avg = sum(values) / len(values) if len(values) > 0 else 0
-        response = f"Average CO2 level is {avg}"
+def answer(routing_key, body):
+    # The receiver keeps the aggregate up to date, every query is answered in O(1)
+    if routing_key == 'rep.current':
+        totals = store.totals()
+        response = f"Latest CO2 level is {totals['last']}" if totals['count'] else "No data received yet"
+    elif routing_key == 'rep.average':
+        response = f"Average CO2 level is {store.totals()['average']}"
+    elif routing_key == 'rep.window':
+        window = store.window()
+        if window['count']:
+            response = (f"CO2 level over the last {WINDOW // 60} minutes: min {window['min']}, "
+                        f"max {window['max']}, average {window['average']}")
+        else:
+            response = f"No data received in the last {WINDOW // 60} minutes"
+    elif routing_key == 'rep.history':
+        # Body: {"sensor": <name, all sensors if left out>, "seconds": <length of the range>}
+        query = parse_history_query(body)
+        if query is None:
+            return "Invalid query"
+        sensor, seconds = query
+        average = history.average(seconds, sensor)
+        subject = sensor or "all sensors"
+        if average is None:
+            response = f"No data received from {subject} in the last {seconds} seconds"
+        else:
+            response = f"Average CO2 level of {subject} over the last {seconds} seconds is {average}"
     else:
         response = "Invalid query"
+    return response
+
+
+def parse_history_query(body):
+    # (sensor or None, seconds), None if the body is not a valid rep.history query
+    try:
+        query = json.loads(body) if body else {}
+    except ValueError:
+        return None
+    if not isinstance(query, dict):
+        return None
+    sensor = query.get('sensor')
+    seconds = query.get('seconds', HISTORY_SECONDS)
+    if sensor is not None and not isinstance(sensor, str):
+        return None
+    if type(seconds) is not int or not 0 < seconds <= MAX_HISTORY_SECONDS:
+        return None
+    return sensor, seconds
+
+
+def on_message(channel, method, properties, body):
+    logging.info(f"Received message with routing key: {method.routing_key}")
     channel.basic_publish(exchange=EXCHANGE_NAME,
                           routing_key=properties.reply_to,
-                          body=response)
+                          body=answer(method.routing_key, body))
 
-if __name__ == '__main__':
-    credentials = PlainCredentials(RMQ_USER, RMQ_PASS)
-    parameters = ConnectionParameters(RMQ_HOST, credentials=credentials)
-    connection = pika.BlockingConnection(parameters)
+
+def answer_batch(batch):
+    logging.info(f"Received {len(batch)} queries")
+    return [(properties.reply_to, answer(method.routing_key, body)) for method, properties, body in batch]
+
+
+def open_stores():
+    global store, history
+    store = AggregateStore()
+    history = TimeSeriesStore()
+
+
+def subscribe(connection, args):
     channel = connection.channel()
 
-    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type=ExchangeType.TOPIC)
+    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type=ExchangeType.topic, durable=True)
 
     result = channel.queue_declare(queue='', exclusive=True)
     queue_name = result.method.queue
@@ -48,7 +100,27 @@ if __name__ == '__main__':
     for routing_key in ROUTING_KEYS:
         channel.queue_bind(exchange=EXCHANGE_NAME, queue=queue_name, routing_key=routing_key)
 
-    channel.basic_consume(queue=queue_name, on_message_callback=on_message, auto_ack=True)
+    if args.batch:
+        BatchConsumer(connection, channel, queue_name, answer_batch, reply_exchange=EXCHANGE_NAME,
+                      prefetch=args.prefetch, batch_size=args.batch_size, workers=args.workers)
+    else:
+        channel.basic_consume(queue=queue_name, on_message_callback=on_message, auto_ack=True)
+    return channel
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', action='store_true', help='consume with manual batched acks')
+    parser.add_argument('--prefetch', type=int, default=PREFETCH)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    args = parser.parse_args()
+
+    open_stores()
+    credentials = PlainCredentials(RMQ_USER, RMQ_PASS)
+    parameters = ConnectionParameters(RMQ_HOST, credentials=credentials)
+    connection = pika.BlockingConnection(parameters)
+    channel = subscribe(connection, args)
 
     print('[*] Waiting for queries from the control tower. Press CTRL+C to exit')
     channel.start_consuming()
@@ -0,0 +1,154 @@
+# Author: Abu Huraira
+# Email: a.huraira@innopolis.university
+
+# Append-only storage of the CO2 readings. Readings are fixed-width binary records
+# (time in epoch nanoseconds, sensor id, value) in memory-mapped segment files, one segment per
+# SEGMENT_SPAN of reading time, so a time range only touches the segments it overlaps.
+#
+# Segment file: header (magic, sorted flag, record count, min time, max time) followed by the records.
+# The header is the per-segment time index: segments that lie inside a queried range are taken whole,
+# the edges of the others are found by binary search while their records are in time order
+# (readings that arrive out of order clear the sorted flag and the segment is filtered instead).
+# Sensor names are mapped to ids in sensors.json.
+
+import json
+import mmap
+import os
+import struct
+import time
+import numpy as np
+
+STORE_DIR = 'co2.store'
+SEGMENT_SPAN = 3600  # seconds of readings per segment
+SEGMENT_RECORDS = 65536  # initial capacity of a segment, doubled whenever it fills up
+
+SEGMENT_MAGIC = b'CO2S'
+HEADER = struct.Struct('<4sIQqq')
+RECORD = np.dtype([('time', '<i8'), ('sensor', '<u4'), ('value', '<f4')])
+SPAN_NS = SEGMENT_SPAN * 10 ** 9
+
+
+class Segment:
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.writable = writable
+        if writable and not os.path.exists(path):
+            with open(path + '.tmp', 'wb') as f:
+                f.write(HEADER.pack(SEGMENT_MAGIC, 1, 0, 2 ** 63 - 1, -2 ** 63))
+                f.truncate(HEADER.size + SEGMENT_RECORDS * RECORD.itemsize)
+            os.replace(path + '.tmp', path)
+        self.map = None
+        self.remap()
+        magic, self.sorted, self.count, self.min_time, self.max_time = HEADER.unpack_from(self.map, 0)
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f"{path} is not a segment file")
+
+    def remap(self, size=None):
+        # Views handed out earlier keep the old mapping alive until they are dropped
+        with open(self.path, 'r+b' if self.writable else 'rb') as f:
+            if size is not None:
+                f.truncate(size)
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ)
+        self.capacity = (len(self.map) - HEADER.size) // RECORD.itemsize
+
+    def refresh(self):
+        # Picks up the records the receiver appended since the last query
+        _, self.sorted, self.count, self.min_time, self.max_time = HEADER.unpack_from(self.map, 0)
+        if self.count > self.capacity:
+            self.remap()
+
+    def append(self, timestamp, sensor, value):
+        if self.count == self.capacity:
+            self.remap(HEADER.size + 2 * self.capacity * RECORD.itemsize)
+        record = np.frombuffer(self.map, RECORD, 1, HEADER.size + self.count * RECORD.itemsize)
+        record[0] = (timestamp, sensor, value)
+        del record
+        if timestamp < self.max_time:
+            self.sorted = 0
+        self.min_time = min(self.min_time, timestamp)
+        self.max_time = max(self.max_time, timestamp)
+        # The header is written after the record, readers never see a record that is not written yet
+        self.count += 1
+        HEADER.pack_into(self.map, 0, SEGMENT_MAGIC, self.sorted, self.count, self.min_time, self.max_time)
+
+    def records(self, start, end):
+        # Records with start <= time < end, a view while the segment is in time order
+        records = np.frombuffer(self.map, RECORD, self.count, HEADER.size)
+        if start <= self.min_time and self.max_time < end:
+            return records
+        if self.sorted:
+            times = records['time']
+            return records[np.searchsorted(times, start):np.searchsorted(times, end)]
+        return records[(records['time'] >= start) & (records['time'] < end)]
+
+    def flush(self):
+        self.map.flush()
+
+
+class TimeSeriesStore:
+    def __init__(self, directory=STORE_DIR, writable=False):
+        self.directory = directory
+        self.writable = writable
+        os.makedirs(directory, exist_ok=True)
+        self.segments = {}  # segment number -> Segment
+        self.sensors = {}
+        self.load_sensors()
+
+    def load_sensors(self):
+        try:
+            with open(os.path.join(self.directory, 'sensors.json')) as f:
+                self.sensors = json.load(f)
+        except FileNotFoundError:
+            self.sensors = {}
+
+    def sensor_id(self, name):
+        if name not in self.sensors:
+            self.sensors[name] = len(self.sensors) + 1
+            path = os.path.join(self.directory, 'sensors.json')
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self.sensors, f)
+            os.replace(path + '.tmp', path)
+        return self.sensors[name]
+
+    def segment(self, number):
+        segment = self.segments.get(number)
+        if segment is None:
+            path = os.path.join(self.directory, f'{number:012d}.seg')
+            if not self.writable and not os.path.exists(path):
+                return None
+            segment = self.segments[number] = Segment(path, self.writable)
+        elif not self.writable:
+            segment.refresh()
+        return segment
+
+    def append(self, timestamp, sensor, value):
+        # timestamp in epoch nanoseconds
+        self.segment(timestamp // SPAN_NS).append(timestamp, self.sensor_id(sensor), value)
+
+    def query(self, start, end, sensor=None):
+        # Records of `sensor` (all sensors if None) with start <= time < end, times in epoch nanoseconds
+        sensor_id = None
+        if sensor is not None:
+            if sensor not in self.sensors:
+                self.load_sensors()
+            sensor_id = self.sensors.get(sensor, 0)
+        parts = []
+        for number in range(start // SPAN_NS, (end - 1) // SPAN_NS + 1):
+            segment = self.segment(number)
+            if segment is None or not segment.count:
+                continue
+            records = segment.records(start, end)
+            if sensor_id is not None:
+                records = records[records['sensor'] == sensor_id]
+            parts.append(records)
+        return np.concatenate(parts) if parts else np.empty(0, RECORD)
+
+    def average(self, seconds, sensor=None, now=None):
+        # Average value over the last `seconds`, None without readings
+        end = time.time_ns() if now is None else now
+        values = self.query(end - seconds * 10 ** 9, end + 1, sensor)['value']
+        return float(values.mean(dtype=np.float64)) if len(values) else None
+
+    def flush(self):
+        for segment in self.segments.values():
+            segment.flush()
@@ -0,0 +1,97 @@
+# Author: Abu Huraira
+# Email: a.huraira@innopolis.university
+
+# GetUsers latency with and without the server's users cache: every client sends GetUsers calls one
+# after another over its own channel, with a PutUser every --write-every calls to invalidate the cache.
+# Each server runs in a temporary directory with its own database.
+
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from threading import Thread
+import grpc
+
+import schema_pb2 as service
+import schema_pb2_grpc as stub
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+SERVER_PORT = 1240
+USERS = 1000
+CLIENTS = 10
+REQUESTS_PER_CLIENT = 200
+WRITE_EVERY = 100
+
+
+def start_server(port, cache, directory):
+    command = [sys.executable, SERVER_SCRIPT, '--port', str(port)] + ([] if cache else ['--no-cache'])
+    process = subprocess.Popen(command, cwd=directory, stdout=subprocess.DEVNULL)
+    channel = grpc.insecure_channel(f'localhost:{port}')
+    try:
+        grpc.channel_ready_future(channel).result(timeout=10)
+    except grpc.FutureTimeoutError:
+        process.kill()
+        raise RuntimeError("server did not start")
+    return process, channel
+
+
+def run_client(port, requests, write_every, latencies):
+    with grpc.insecure_channel(f'localhost:{port}') as channel:
+        database = stub.DatabaseStub(channel)
+        for i in range(requests):
+            if write_every and i % write_every == write_every - 1:
+                database.PutUser(service.User(user_id=i % USERS + 1, user_name=f"User{i}"))
+                continue
+            t0 = time.perf_counter()
+            database.GetUsers(service.EmptyMessage())
+            latencies.append(time.perf_counter() - t0)
+
+
+def benchmark(port, cache, clients, requests, write_every):
+    with tempfile.TemporaryDirectory() as directory:
+        process, channel = start_server(port, cache, directory)
+        try:
+            database = stub.DatabaseStub(channel)
+            database.PutUsers(service.User(user_id=i, user_name=f"User{i}") for i in range(1, USERS + 1))
+            latencies = []
+            threads = [Thread(target=run_client, args=(port, requests, write_every, latencies))
+                       for _ in range(clients)]
+            t0 = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - t0
+            stats = database.GetCacheStats(service.EmptyMessage())
+            channel.close()
+        finally:
+            process.send_signal(signal.SIGINT)
+            process.wait()
+
+    latencies.sort()
+    result = {
+        'reads/s': len(latencies) / elapsed,
+        'p50 ms': latencies[len(latencies) // 2] * 1000,
+        'p99 ms': latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+    if stats.enabled:
+        result['hit rate %'] = 100 * stats.hits / max(1, stats.hits + stats.misses)
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=CLIENTS)
+    parser.add_argument('--requests', type=int, default=REQUESTS_PER_CLIENT, help='requests per client')
+    parser.add_argument('--write-every', type=int, default=WRITE_EVERY, help='0 sends only reads')
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    args = parser.parse_args()
+
+    print(f"{USERS} users, {args.clients} clients x {args.requests} requests, "
+          f"a write every {args.write_every or 'no'} requests")
+    for name, cache in [('no cache', False), ('cache', True)]:
+        result = benchmark(args.port, cache, args.clients, args.requests, args.write_every)
+        print(f"{name:>8}: " + ', '.join(f"{key} = {value:.1f}" for key, value in result.items()))
@@ -19,6 +19,41 @@ def get_users():
     print(f"GetUsers() = {result}")
 
 
+def put_users(users):
+    # users: (user_id, user_name) pairs, sent as one client stream and committed together
+    response = stub.PutUsers(service.User(user_id=user_id, user_name=user_name) for user_id, user_name in users)
+    print(f"PutUsers() = {sum(response.status)}/{len(response.status)} stored")
+
+
+def batch_mutate(puts, deletes):
+    mutations = [service.Mutation(put=service.User(user_id=user_id, user_name=user_name)) for user_id, user_name in puts]
+    mutations += [service.Mutation(delete=service.User(user_id=user_id)) for user_id in deletes]
+    response = stub.BatchMutate(service.Mutations(mutations=mutations))
+    print(f"BatchMutate({len(puts)} puts, {len(deletes)} deletes) = {sum(response.status)}/{len(response.status)} applied")
+
+
+def stream_users():
+    args = service.EmptyMessage()
+    result = {}
+    for batch in stub.StreamUsers(args):
+        for user in batch.users:
+            result[user.user_id] = user.user_name
+    print(f"StreamUsers() = {result}")
+
+
+def get_users_paged(limit):
+    result = {}
+    args = service.Page(limit=limit)
+    while True:
+        response = stub.GetUsersPage(args)
+        for user in response.users:
+            result[user.user_id] = user.user_name
+        if not response.has_more:
+            break
+        args = service.Page(after_id=response.users[-1].user_id, limit=limit)
+    print(f"GetUsersPage(limit={limit}) = {result}")
+
+
 def delete_user(user_id):
     args = service.User(user_id=user_id)
     response = stub.DeleteUser(args)
@@ -40,3 +75,12 @@ if __name__ == '__main__':
 
         # Retrieve all users
         get_users()
+
+        # Retrieve all users as a stream and page by page
+        stream_users()
+        get_users_paged(2)
+
+        # Bulk load users in one transaction, then rename and delete some of them in one batch
+        put_users((i, f"User{i}") for i in range(5, 1005))
+        batch_mutate([(1, "User1_updated")], range(5, 1005))
+        get_users()
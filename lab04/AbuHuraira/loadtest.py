@@ -0,0 +1,96 @@
+# Author: Abu Huraira
+# Email: a.huraira@innopolis.university
+
+# Compares the threaded and the asyncio modes of server.py at high concurrency: a grpc.aio client keeps
+# --concurrency RPCs in flight (GetUsersPage reads with a PutUser every --write-every calls) and reports
+# QPS and latency percentiles. Each server runs in a temporary directory with its own database.
+
+import argparse
+import asyncio
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import grpc
+
+import schema_pb2 as service
+import schema_pb2_grpc as stub
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+SERVER_PORT = 1241
+USERS = 10000
+CONCURRENCY = 200
+REQUESTS = 20000
+PAGE_LIMIT = 20
+WRITE_EVERY = 20
+
+
+def start_server(mode, port, directory):
+    process = subprocess.Popen([sys.executable, SERVER_SCRIPT, '--mode', mode, '--port', str(port)],
+                               cwd=directory, stdout=subprocess.DEVNULL)
+    with grpc.insecure_channel(f'localhost:{port}') as channel:
+        try:
+            grpc.channel_ready_future(channel).result(timeout=10)
+        except grpc.FutureTimeoutError:
+            process.kill()
+            raise RuntimeError(f"{mode} server did not start")
+        stub.DatabaseStub(channel).PutUsers(service.User(user_id=i, user_name=f"User{i}")
+                                            for i in range(1, USERS + 1))
+    return process
+
+
+async def run_load(port, concurrency, requests, write_every):
+    latencies = []
+    remaining = iter(range(requests))
+
+    async def worker(database):
+        for i in remaining:
+            t0 = time.perf_counter()
+            if write_every and i % write_every == write_every - 1:
+                await database.PutUser(service.User(user_id=random.randint(1, USERS), user_name=f"User{i}"))
+            else:
+                await database.GetUsersPage(service.Page(after_id=random.randint(0, USERS), limit=PAGE_LIMIT))
+            latencies.append(time.perf_counter() - t0)
+
+    async with grpc.aio.insecure_channel(f'localhost:{port}') as channel:
+        database = stub.DatabaseStub(channel)
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker(database) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+    return latencies, elapsed
+
+
+def benchmark(mode, port, concurrency, requests, write_every):
+    with tempfile.TemporaryDirectory() as directory:
+        process = start_server(mode, port, directory)
+        try:
+            latencies, elapsed = asyncio.run(run_load(port, concurrency, requests, write_every))
+        finally:
+            process.send_signal(signal.SIGINT)
+            process.wait()
+
+    latencies.sort()
+    return {
+        'QPS': len(latencies) / elapsed,
+        'p50 ms': latencies[len(latencies) // 2] * 1000,
+        'p99 ms': latencies[int(len(latencies) * 0.99)] * 1000,
+        'p99.9 ms': latencies[int(len(latencies) * 0.999)] * 1000,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help='RPCs in flight')
+    parser.add_argument('--requests', type=int, default=REQUESTS)
+    parser.add_argument('--write-every', type=int, default=WRITE_EVERY, help='0 sends only reads')
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    args = parser.parse_args()
+
+    print(f"{USERS} users, {args.requests} requests, {args.concurrency} in flight, "
+          f"a write every {args.write_every or 'no'} requests")
+    for mode in ['threaded', 'asyncio']:
+        result = benchmark(mode, args.port, args.concurrency, args.requests, args.write_every)
+        print(f"{mode:>9}: " + ', '.join(f"{key} = {value:.1f}" for key, value in result.items()))
@@ -13,7 +13,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0cschema.proto\x12\x06schema\"*\n\x04User\x12\x0f\n\x07user_id\x18\x01 \x01(\x05\x12\x11\n\tuser_name\x18\x02 \x01(\t\"\x0e\n\x0c\x45mptyMessage\"\x18\n\x06status\x12\x0e\n\x06status\x18\x01 \x01(\x08\"$\n\x05Users\x12\x1b\n\x05users\x18\x01 \x03(\x0b\x32\x0c.schema.User2\x96\x01\n\x08\x44\x61tabase\x12)\n\x07PutUser\x12\x0c.schema.User\x1a\x0e.schema.status\"\x00\x12,\n\nDeleteUser\x12\x0c.schema.User\x1a\x0e.schema.status\"\x00\x12\x31\n\x08GetUsers\x12\x14.schema.EmptyMessage\x1a\r.schema.Users\"\x00\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0cschema.proto\x12\x06schema\"*\n\x04User\x12\x0f\n\x07user_id\x18\x01 \x01(\x05\x12\x11\n\tuser_name\x18\x02 \x01(\t\"\x0e\n\x0c\x45mptyMessage\"9\n\x04Page\x12\x15\n\x08\x61\x66ter_id\x18\x01 \x01(\x05H\x00\x88\x01\x01\x12\r\n\x05limit\x18\x02 \x01(\x05\x42\x0b\n\t_after_id\"\x18\n\x06status\x12\x0e\n\x06status\x18\x01 \x01(\x08\"\x1a\n\x08statuses\x12\x0e\n\x06status\x18\x01 \x03(\x08\"$\n\x05Users\x12\x1b\n\x05users\x18\x01 \x03(\x0b\x32\x0c.schema.User\"T\n\x08Mutation\x12\x1b\n\x03put\x18\x01 \x01(\x0b\x32\x0c.schema.UserH\x00\x12\x1e\n\x06\x64\x65lete\x18\x02 \x01(\x0b\x32\x0c.schema.UserH\x00\x42\x0b\n\toperation\"0\n\tMutations\x12#\n\tmutations\x18\x01 \x03(\x0b\x32\x10.schema.Mutation\"c\n\nCacheStats\x12\x0f\n\x07\x65nabled\x18\x01 \x01(\x08\x12\x0c\n\x04hits\x18\x02 \x01(\x04\x12\x0e\n\x06misses\x18\x03 \x01(\x04\x12\x15\n\rinvalidations\x18\x04 \x01(\x04\x12\x0f\n\x07version\x18\x05 \x01(\x04\":\n\tUsersPage\x12\x1b\n\x05users\x18\x01 \x03(\x0b\x32\x0c.schema.User\x12\x10\n\x08has_more\x18\x02 \x01(\x08\x32\xa4\x03\n\x08\x44\x61tabase\x12)\n\x07PutUser\x12\x0c.schema.User\x1a\x0e.schema.status\"\x00\x12,\n\nDeleteUser\x12\x0c.schema.User\x1a\x0e.schema.status\"\x00\x12\x31\n\x08GetUsers\x12\x14.schema.EmptyMessage\x1a\r.schema.Users\"\x00\x12\x36\n\x0bStreamUsers\x12\x14.schema.EmptyMessage\x1a\r.schema.Users\"\x00\x30\x01\x12\x31\n\x0cGetUsersPage\x12\x0c.schema.Page\x1a\x11.schema.UsersPage\"\x00\x12.\n\x08PutUsers\x12\x0c.schema.User\x1a\x10.schema.statuses\"\x00(\x01\x12\x34\n\x0b\x42\x61tchMutate\x12\x11.schema.Mutations\x1a\x10.schema.statuses\"\x00\x12;\n\rGetCacheStats\x12\x14.schema.EmptyMessage\x1a\x12.schema.CacheStats\"\x00\x62\x06proto3')
 
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'schema_pb2', globals())
@@ -24,10 +24,22 @@ if _descriptor._USE_C_DESCRIPTORS == False:
   _USER._serialized_end=66
   _EMPTYMESSAGE._serialized_start=68
   _EMPTYMESSAGE._serialized_end=82
-  _STATUS._serialized_start=84
-  _STATUS._serialized_end=108
-  _USERS._serialized_start=110
-  _USERS._serialized_end=146
-  _DATABASE._serialized_start=149
-  _DATABASE._serialized_end=299
+  _PAGE._serialized_start=84
+  _PAGE._serialized_end=141
+  _STATUS._serialized_start=143
+  _STATUS._serialized_end=167
+  _STATUSES._serialized_start=169
+  _STATUSES._serialized_end=195
+  _USERS._serialized_start=197
+  _USERS._serialized_end=233
+  _MUTATION._serialized_start=235
+  _MUTATION._serialized_end=319
+  _MUTATIONS._serialized_start=321
+  _MUTATIONS._serialized_end=369
+  _CACHESTATS._serialized_start=371
+  _CACHESTATS._serialized_end=470
+  _USERSPAGE._serialized_start=472
+  _USERSPAGE._serialized_end=530
+  _DATABASE._serialized_start=533
+  _DATABASE._serialized_end=953
 # @@protoc_insertion_point(module_scope)
@@ -29,6 +29,31 @@ class DatabaseStub(object):
                 request_serializer=schema__pb2.EmptyMessage.SerializeToString,
                 response_deserializer=schema__pb2.Users.FromString,
                 )
+        self.StreamUsers = channel.unary_stream(
+                '/schema.Database/StreamUsers',
+                request_serializer=schema__pb2.EmptyMessage.SerializeToString,
+                response_deserializer=schema__pb2.Users.FromString,
+                )
+        self.GetUsersPage = channel.unary_unary(
+                '/schema.Database/GetUsersPage',
+                request_serializer=schema__pb2.Page.SerializeToString,
+                response_deserializer=schema__pb2.UsersPage.FromString,
+                )
+        self.PutUsers = channel.stream_unary(
+                '/schema.Database/PutUsers',
+                request_serializer=schema__pb2.User.SerializeToString,
+                response_deserializer=schema__pb2.statuses.FromString,
+                )
+        self.BatchMutate = channel.unary_unary(
+                '/schema.Database/BatchMutate',
+                request_serializer=schema__pb2.Mutations.SerializeToString,
+                response_deserializer=schema__pb2.statuses.FromString,
+                )
+        self.GetCacheStats = channel.unary_unary(
+                '/schema.Database/GetCacheStats',
+                request_serializer=schema__pb2.EmptyMessage.SerializeToString,
+                response_deserializer=schema__pb2.CacheStats.FromString,
+                )
 
 
 class DatabaseServicer(object):
@@ -52,6 +77,36 @@ class DatabaseServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def StreamUsers(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetUsersPage(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def PutUsers(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def BatchMutate(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetCacheStats(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_DatabaseServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -70,6 +125,31 @@ def add_DatabaseServicer_to_server(servicer, server):
                     request_deserializer=schema__pb2.EmptyMessage.FromString,
                     response_serializer=schema__pb2.Users.SerializeToString,
             ),
+            'StreamUsers': grpc.unary_stream_rpc_method_handler(
+                    servicer.StreamUsers,
+                    request_deserializer=schema__pb2.EmptyMessage.FromString,
+                    response_serializer=schema__pb2.Users.SerializeToString,
+            ),
+            'GetUsersPage': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetUsersPage,
+                    request_deserializer=schema__pb2.Page.FromString,
+                    response_serializer=schema__pb2.UsersPage.SerializeToString,
+            ),
+            'PutUsers': grpc.stream_unary_rpc_method_handler(
+                    servicer.PutUsers,
+                    request_deserializer=schema__pb2.User.FromString,
+                    response_serializer=schema__pb2.statuses.SerializeToString,
+            ),
+            'BatchMutate': grpc.unary_unary_rpc_method_handler(
+                    servicer.BatchMutate,
+                    request_deserializer=schema__pb2.Mutations.FromString,
+                    response_serializer=schema__pb2.statuses.SerializeToString,
+            ),
+            'GetCacheStats': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetCacheStats,
+                    request_deserializer=schema__pb2.EmptyMessage.FromString,
+                    response_serializer=schema__pb2.CacheStats.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'schema.Database', rpc_method_handlers)
@@ -130,3 +210,88 @@ class Database(object):
             schema__pb2.Users.FromString,
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def StreamUsers(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(request, target, '/schema.Database/StreamUsers',
+            schema__pb2.EmptyMessage.SerializeToString,
+            schema__pb2.Users.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def GetUsersPage(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/schema.Database/GetUsersPage',
+            schema__pb2.Page.SerializeToString,
+            schema__pb2.UsersPage.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def PutUsers(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(request_iterator, target, '/schema.Database/PutUsers',
+            schema__pb2.User.SerializeToString,
+            schema__pb2.statuses.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def BatchMutate(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/schema.Database/BatchMutate',
+            schema__pb2.Mutations.SerializeToString,
+            schema__pb2.statuses.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def GetCacheStats(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/schema.Database/GetCacheStats',
+            schema__pb2.EmptyMessage.SerializeToString,
+            schema__pb2.CacheStats.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
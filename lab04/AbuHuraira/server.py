@@ -1,7 +1,11 @@
 # Author: Abu Huraira
 # Email: a.huraira@innopolis.university
 
+import argparse
+import asyncio
+import signal
 import sqlite3
+import threading
 from concurrent.futures import ThreadPoolExecutor
 import grpc
 
@@ -9,70 +13,323 @@ import schema_pb2 as service
 import schema_pb2_grpc as stub
 
 
-SERVER_ADDR = '0.0.0.0:1234'
+SERVER_HOST = '0.0.0.0'
+SERVER_PORT = 1234
 DB_NAME = 'db.sqlite'
+MAX_WORKERS = 10  # server threads, each gets one pooled SQLite connection
+DB_WORKERS = 4  # asyncio mode: threads running the SQLite work off the event loop
+SHUTDOWN_GRACE = 5  # seconds in-flight RPCs get to finish on SIGINT/SIGTERM in asyncio mode
+STATEMENT_CACHE = 64  # prepared statements kept per connection
+STREAM_BATCH = 500  # rows per StreamUsers message
+PAGE_SIZE = 100  # users per GetUsersPage page if the client does not ask for a size
+MAX_PAGE_SIZE = 1000
+
+# Parameterized statements, sqlite3 prepares each one once per connection and reuses it
+PUT_USER = 'INSERT INTO Users (id, name) VALUES (?, ?) ON CONFLICT (id) DO UPDATE SET name = excluded.name'
+DELETE_USER = 'DELETE FROM Users WHERE id = ?'
+GET_USERS = 'SELECT id, name FROM Users ORDER BY id'
+# Keyset pagination: the page starts right after the last id of the previous one,
+# so every page is an index range scan no matter how deep it is
+GET_USERS_FIRST_PAGE = 'SELECT id, name FROM Users ORDER BY id LIMIT ?'
+GET_USERS_PAGE = 'SELECT id, name FROM Users WHERE id > ? ORDER BY id LIMIT ?'
 
 def initialize_db():
     conn = sqlite3.connect(DB_NAME)
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS Users
                  (id INTEGER PRIMARY KEY, name TEXT NOT NULL)''')
+    # Readers do not block the writer and a commit appends to the log instead of rewriting pages,
+    # the journal mode is stored in the database file
+    c.execute('PRAGMA journal_mode=WAL')
     conn.commit()
     conn.close()
 
+class ConnectionPool:
+    """One SQLite connection per server thread, opened on its first RPC and reused for every later one.
+    With one connection per ThreadPoolExecutor worker the pool never holds more than max_workers."""
+    def __init__(self, db_name, size):
+        self.db_name = db_name
+        self.size = size
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            with self.lock:
+                if len(self.connections) >= self.size:
+                    raise RuntimeError(f"More than {self.size} threads use the connection pool")
+                # Only this thread uses it, close() runs after the server stopped
+                conn = sqlite3.connect(self.db_name, check_same_thread=False, cached_statements=STATEMENT_CACHE)
+                conn.execute('PRAGMA synchronous=NORMAL')  # durable at WAL checkpoints, no fsync per commit
+                self.connections.append(conn)
+            self.local.conn = conn
+        return conn
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections.clear()
+
+class UsersCache:
+    """Read-through cache of the whole users table as a ready Users message.
+    Every write bumps the version after its commit. A table loaded on a miss is only kept if the version
+    did not change while it was read, so a reader racing with a writer cannot cache rows from before
+    the write. Concurrent RPCs share the cached message read-only."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = None
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, load):
+        with self.lock:
+            if self.users is not None:
+                self.hits += 1
+                return self.users
+            self.misses += 1
+            version = self.version
+        users = load()
+        with self.lock:
+            if self.version == version:
+                self.users = users
+        return users
+
+    def cached(self):
+        # The cached message or None, never loads
+        with self.lock:
+            if self.users is not None:
+                self.hits += 1
+            return self.users
+
+    def invalidate(self):
+        with self.lock:
+            self.version += 1
+            self.invalidations += 1
+            self.users = None
+
+    def stats(self):
+        with self.lock:
+            return service.CacheStats(enabled=True, hits=self.hits, misses=self.misses,
+                                      invalidations=self.invalidations, version=self.version)
+
 class Database(stub.DatabaseServicer):
+    def __init__(self, pool, cache=None):
+        self.pool = pool
+        self.cache = cache
+
+    def invalidate(self):
+        if self.cache is not None:
+            self.cache.invalidate()
+
+    def apply(self, operations):
+        # Runs (statement, parameters) pairs in one transaction with one commit. A statement that fails
+        # is rolled back on its own by SQLite and reported in its status, the others still commit
+        conn = self.pool.connection()
+        statuses = []
+        with conn:
+            for statement, parameters in operations:
+                if statement is None:
+                    statuses.append(False)
+                    continue
+                try:
+                    conn.execute(statement, parameters)
+                    statuses.append(True)
+                except sqlite3.Error as e:
+                    print(e)
+                    statuses.append(False)
+        self.invalidate()
+        return service.statuses(status=statuses)
+
     def PutUser(self, request, context):
+        # Inserts the user or renames an existing one
         print(f"PutUser({request.user_id}, '{request.user_name}')")
-        conn = sqlite3.connect(DB_NAME)
-        c = conn.cursor()
+        conn = self.pool.connection()
         try:
-            c.execute(f"INSERT INTO Users (id, name) VALUES ({request.user_id}, '{request.user_name}')")
-            conn.commit()
+            with conn:
+                conn.execute(PUT_USER, (request.user_id, request.user_name))
+            self.invalidate()
             return service.status(status=True)
         except Exception as e:
             print(e)
             return service.status(status=False)
-        finally:
-            conn.close()
 
     def DeleteUser(self, request, context):
         print(f"DeleteUser({request.user_id})")
-        conn = sqlite3.connect(DB_NAME)
-        c = conn.cursor()
+        conn = self.pool.connection()
         try:
-            c.execute(f"DELETE FROM Users WHERE id={request.user_id}")
-            conn.commit()
+            with conn:
+                conn.execute(DELETE_USER, (request.user_id,))
+            self.invalidate()
             return service.status(status=True)
         except Exception as e:
             print(e)
             return service.status(status=False)
-        finally:
-            conn.close()
+
+    def PutUsers(self, request_iterator, context):
+        # Client-streaming bulk upsert committed once at the end. The stream is collected before the
+        # transaction opens, so a slow client never holds the SQLite write lock
+        print("PutUsers()")
+        return self.apply([(PUT_USER, (user.user_id, user.user_name)) for user in request_iterator])
+
+    def BatchMutate(self, request, context):
+        print(f"BatchMutate({len(request.mutations)})")
+        operations = []
+        for mutation in request.mutations:
+            operation = mutation.WhichOneof('operation')
+            if operation == 'put':
+                operations.append((PUT_USER, (mutation.put.user_id, mutation.put.user_name)))
+            elif operation == 'delete':
+                operations.append((DELETE_USER, (mutation.delete.user_id,)))
+            else:
+                operations.append((None, None))
+        return self.apply(operations)
 
     def GetUsers(self, request, context):
         print("GetUsers()")
-        conn = sqlite3.connect(DB_NAME)
-        c = conn.cursor()
         try:
-            c.execute("SELECT * FROM Users")
-            rows = c.fetchall()
-            users = []
-            for row in rows:
-                user = service.User(user_id=row[0], user_name=row[1])
-                users.append(user)
-            return service.Users(users=users)
+            if self.cache is not None:
+                return self.cache.get(self.load_users)
+            return self.load_users()
         except Exception as e:
             print(e)
             return service.Users(users=[])
 
-if __name__ == '__main__':
-    initialize_db()
-    server = grpc.server(ThreadPoolExecutor(max_workers=10))
-    stub.add_DatabaseServicer_to_server(Database(), server)
-    server.add_insecure_port(SERVER_ADDR)
+    def load_users(self):
+        c = self.pool.connection().cursor()
+        c.execute(GET_USERS)
+        rows = c.fetchall()
+        users = []
+        for row in rows:
+            user = service.User(user_id=row[0], user_name=row[1])
+            users.append(user)
+        return service.Users(users=users)
+
+    def GetCacheStats(self, request, context):
+        if self.cache is None:
+            return service.CacheStats(enabled=False)
+        return self.cache.stats()
+
+    def StreamUsers(self, request, context):
+        # Rows go out in fetchmany batches as they are read, memory stays at one batch
+        print("StreamUsers()")
+        c = self.pool.connection().cursor()
+        c.execute(GET_USERS)
+        while rows := c.fetchmany(STREAM_BATCH):
+            yield service.Users(users=[service.User(user_id=row[0], user_name=row[1]) for row in rows])
+
+    def GetUsersPage(self, request, context):
+        after_id = request.after_id if request.HasField('after_id') else None
+        print(f"GetUsersPage({after_id}, {request.limit})")
+        # 0 is an unset limit, a negative one still gets a page of one user
+        limit = max(1, min(request.limit or PAGE_SIZE, MAX_PAGE_SIZE))
+        return self.users_page(after_id, limit)
+
+    def users_page(self, after_id, limit):
+        conn = self.pool.connection()
+        # One row more than the page tells whether another page follows
+        if after_id is not None:
+            rows = conn.execute(GET_USERS_PAGE, (after_id, limit + 1)).fetchall()
+        else:
+            rows = conn.execute(GET_USERS_FIRST_PAGE, (limit + 1,)).fetchall()
+        users = [service.User(user_id=row[0], user_name=row[1]) for row in rows[:limit]]
+        return service.UsersPage(users=users, has_more=len(rows) > limit)
+
+class AsyncDatabase(stub.DatabaseServicer):
+    """grpc.aio servicer: the event loop only handles RPCs, the SQLite work of the Database methods runs on
+    a small executor whose threads hold the pooled connections, so concurrency is not capped by a thread
+    per RPC. Cache hits are answered on the event loop."""
+    def __init__(self, database, executor):
+        self.database = database
+        self.executor = executor
+
+    async def run(self, method, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, method, *args)
+
+    async def PutUser(self, request, context):
+        return await self.run(self.database.PutUser, request, None)
+
+    async def DeleteUser(self, request, context):
+        return await self.run(self.database.DeleteUser, request, None)
+
+    async def PutUsers(self, request_iterator, context):
+        # The stream is collected on the event loop, not on a DB thread
+        users = [user async for user in request_iterator]
+        return await self.run(self.database.PutUsers, iter(users), None)
+
+    async def BatchMutate(self, request, context):
+        return await self.run(self.database.BatchMutate, request, None)
+
+    async def GetUsers(self, request, context):
+        if self.database.cache is not None:
+            users = self.database.cache.cached()
+            if users is not None:
+                print("GetUsers()")
+                return users
+        return await self.run(self.database.GetUsers, request, None)
+
+    async def GetCacheStats(self, request, context):
+        return self.database.GetCacheStats(request, None)
+
+    async def StreamUsers(self, request, context):
+        # Keyset batches instead of one long-lived cursor, so every batch can run on any DB thread
+        print("StreamUsers()")
+        after_id = None
+        while True:
+            page = await self.run(self.database.users_page, after_id, STREAM_BATCH)
+            if page.users:
+                yield service.Users(users=page.users)
+            if not page.has_more:
+                break
+            after_id = page.users[-1].user_id
+
+    async def GetUsersPage(self, request, context):
+        return await self.run(self.database.GetUsersPage, request, None)
+
+async def async_server(server_addr, cache):
+    pool = ConnectionPool(DB_NAME, DB_WORKERS)
+    executor = ThreadPoolExecutor(max_workers=DB_WORKERS)
+    server = grpc.aio.server()
+    stub.add_DatabaseServicer_to_server(AsyncDatabase(Database(pool, cache), executor), server)
+    server.add_insecure_port(server_addr)
+    await server.start()
+    print(f"gRPC asyncio server is listening on {server_addr}")
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, lambda: asyncio.ensure_future(server.stop(SHUTDOWN_GRACE)))
+    await server.wait_for_termination()
+    executor.shutdown()
+    pool.close()
+
+def threaded_server(server_addr, cache):
+    pool = ConnectionPool(DB_NAME, MAX_WORKERS)
+    server = grpc.server(ThreadPoolExecutor(max_workers=MAX_WORKERS))
+    stub.add_DatabaseServicer_to_server(Database(pool, cache), server)
+    server.add_insecure_port(server_addr)
     server.start()
-    print(f"gRPC server is listening on {SERVER_ADDR}")
+    print(f"gRPC server is listening on {server_addr}")
     try:
         server.wait_for_termination()
     except KeyboardInterrupt:
         server.stop(0)
+    pool.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=['threaded', 'asyncio'], default='threaded')
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--no-cache', action='store_true', help='read every GetUsers from SQLite')
+    args = parser.parse_args()
+    server_addr = f'{SERVER_HOST}:{args.port}'
+
+    initialize_db()
+    cache = None if args.no_cache else UsersCache()
+    if args.mode == 'asyncio':
+        asyncio.run(async_server(server_addr, cache))
+    else:
+        threaded_server(server_addr, cache)
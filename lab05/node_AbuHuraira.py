@@ -1,78 +1,248 @@
+import json
+import os
 from argparse import ArgumentParser
-from bisect import bisect_left
-from threading import Thread
-from xmlrpc.client import ServerProxy
+from bisect import bisect_left, bisect_right, insort
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread
+from xmlrpc.client import Fault, ServerProxy
 from xmlrpc.server import SimpleXMLRPCServer
 
 M = 5
 PORT = 1234
 RING = [2, 7, 11, 17, 22, 27]
+REPLICAS = 2  # copies of every item: the responsible node and the next REPLICAS - 1 nodes of its successor list
+LOG_DIR = '.'
+LOG_FILE = 'node_{}.log'  # append-only log of one JSON record per line, replayed on restart
+
+
+def node_proxy(node_id):
+    """Returns an RPC proxy of the given node, which listens on PORT + node_id"""
+    return ServerProxy(f'http://localhost:{PORT + node_id}')
+
+
+class ThreadingXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    """Serves every request on its own thread, so a node waiting on a forwarded put can still take the
+    replication RPC that comes back to it"""
+    daemon_threads = True
+
+
+def in_range(key, start, end):
+    """Whether key lies in the ring interval (start, end]"""
+    if start < end:
+        return start < key <= end
+    return key > start or key <= end
+
+
+def ring_successor(id):
+    """Returns the first node of the static RING at or after the given id"""
+    return next((node_id for node_id in RING if node_id >= id), RING[0])
+
+
+def successor_list(node_id, count):
+    """Returns the count nodes following node_id on the ring"""
+    i = RING.index(node_id)
+    return [RING[(i + j) % len(RING)] for j in range(1, min(count, len(RING) - 1) + 1)]
+
+
+def predecessor_list(node_id, count):
+    """Returns the count nodes preceding node_id on the ring, nearest first"""
+    i = RING.index(node_id)
+    return [RING[(i - j) % len(RING)] for j in range(1, min(count, len(RING) - 1) + 1)]
 
 
 class Node:
-    def __init__(self, node_id):
+    def __init__(self, node_id, replicas=REPLICAS, log_dir=LOG_DIR):
         """Initializes the node properties and constructs the finger table according to the Chord formula"""
         self.id = node_id
+        self.data = {}  # key -> value
+        self.keys = []  # sorted keys, ordered index for range handoff
+        self.lock = Lock()
+        self.replicas = replicas
+        self.successors = successor_list(node_id, replicas - 1)
+        self.log = open(os.path.join(log_dir, LOG_FILE.format(node_id)), 'a+')
+        self.replay()
+        # The initial fingers come from the static RING, the other nodes may not be up yet
         self.finger_table = []
         for i in range(M):
             start = (self.id + 2**i) % 2**M
-            self.finger_table.append((start, self.find_successor(start)))
+            self.finger_table.append((start, ring_successor(start)))
         print(f"Node {self.id} created! Finger table = {self.finger_table}")
 
     def closest_preceding_node(self, id):
         """Returns node_id of the closest preceeding node (from n.finger_table) for a given id"""
         for i in range(M - 1, -1, -1):
-            if self.finger_table[i][1] != self.id and self.finger_table[i][1] < id:
-                return self.finger_table[i][1]
+            node_id = self.finger_table[i][1]
+            if node_id != id and in_range(node_id, self.id, id):
+                return node_id
         return self.id
 
     def find_successor(self, id):
         """Recursive function returning the identifier of the node responsible for a given id"""
         if id == self.id:
             return self.id
-        succ = self.closest_preceding_node(id)
-        if succ == self.id:
-            proxy = None
-        else:
-            proxy = ServerProxy(f'http://localhost:{succ}')
-        return proxy.find_successor(id) if proxy else self.id
+        succ = self.finger_table[0][1]
+        if in_range(id, self.id, succ):
+            return succ
+        node_id = self.closest_preceding_node(id)
+        if node_id == self.id:
+            return succ
+        return node_proxy(node_id).find_successor(id)
 
     def put(self, key, value):
         """Stores the given key-value pair in the node responsible for it"""
-        if self.find_successor(key) == self.id:
+        owner = self.find_successor(key)
+        if owner == self.id:
             self.store_item(key, value)
             print(f"put({key}, {value})")
             return True
         else:
-            proxy = ServerProxy(f'http://localhost:{self.find_successor(key)}')
-            return proxy.put(key, value)
+            return node_proxy(owner).put(key, value)
 
     def get(self, key):
         """Gets the value for a given key from the node responsible for it"""
-        if self.find_successor(key) == self.id:
+        owner = self.find_successor(key)
+        if owner == self.id:
             value = self.retrieve_item(key)
             print(f"get({key}) = {value}")
             return value
         else:
-            proxy = ServerProxy(f'http://localhost:{self.find_successor(key)}')
-            return proxy.get(key)
+            return node_proxy(owner).get(key)
 
     def store_item(self, key, value):
-        """Stores a key-value pair into the data store of this node"""
+        """Stores a key-value pair into the data store of this node and replicates it to its successors"""
+        self.replicate(key, value)
+        for succ in self.successors:
+            try:
+                node_proxy(succ).replicate(key, value)
+            except (OSError, Fault) as e:
+                print(f"Replication of {key} to node {succ} failed: {e}")
         return True
 
     def retrieve_item(self, key):
         """Retrieves a value for a given key from the data store of this node"""
-        return -1
+        return self.data.get(key, -1)
+
+    def replicate(self, key, value):
+        """Stores a key-value pair into the data store of this node only"""
+        with self.lock:
+            self.write([['put', key, value]])
+            self.insert(key, value)
+        return True
+
+    def store_items(self, items):
+        """Stores a list of [key, value] pairs with a single log write, e.g. a range handed over by another node"""
+        with self.lock:
+            self.write([['put', key, value] for key, value in items])
+            for key, value in items:
+                self.data[key] = value
+            self.keys = sorted(self.data)
+        return True
+
+    def items_in_range(self, start, end):
+        """Returns the [key, value] pairs stored here with keys in the ring interval (start, end]"""
+        with self.lock:
+            return [[key, self.data[key]] for lo, hi in self.range_slices(start, end) for key in self.keys[lo:hi]]
+
+    def drop_range(self, start, end):
+        """Drops the items with keys in (start, end], which a node that joined in front of this one now holds"""
+        with self.lock:
+            keys = []
+            for lo, hi in self.range_slices(start, end):
+                keys += self.keys[lo:hi]
+                del self.keys[lo:hi]
+            self.write([['delete', key] for key in keys])
+            for key in keys:
+                del self.data[key]
+        print(f"Dropped {len(keys)} items in ({start}, {end}]")
+        return len(keys)
+
+    def join(self):
+        """Copies the items this node holds from its neighbours, then the successors that stop holding them drop them"""
+        succs = successor_list(self.id, self.replicas)
+        if not succs:
+            return
+        if self.replicas >= len(RING):
+            sources, drops = [(succs[0], self.id, self.id)], []  # every node holds every item
+        else:
+            # This node holds its own range, which its successor holds, and the replicas of its replicas - 1
+            # predecessors, which its predecessor holds. The j-th successor now has this node among its
+            # predecessors and gives up the range of the predecessor that moved out of its replica set
+            preds = [self.id] + predecessor_list(self.id, self.replicas)
+            sources = [(succs[0], preds[1], self.id)]
+            if self.replicas > 1:
+                sources.append((preds[1], preds[-1], preds[1]))
+            drops = [(succ, preds[self.replicas - j], preds[self.replicas - j - 1]) for j, succ in enumerate(succs)]
+        items = []
+        for node_id, start, end in sources:
+            try:
+                items += node_proxy(node_id).items_in_range(start, end)
+            except (OSError, Fault) as e:
+                print(f"No handoff from node {node_id}: {e}")
+                return
+        # Persisted here before anything is dropped, a lost reply only means the range is copied again
+        self.store_items(items)
+        for succ, start, end in drops:
+            try:
+                node_proxy(succ).drop_range(start, end)
+            except (OSError, Fault) as e:
+                print(f"Node {succ} did not drop ({start}, {end}]: {e}")
+
+    def range_slices(self, start, end):
+        # Index slices of the ordered index holding (start, end], found with two bisects. An interval
+        # wrapping around zero is two slices, the later one first so deleting it keeps the other valid
+        lo, hi = bisect_right(self.keys, start), bisect_right(self.keys, end)
+        if start < end:
+            return [(lo, hi)]
+        return [(lo, len(self.keys)), (0, hi)]
+
+    def insert(self, key, value):
+        if key not in self.data:
+            insort(self.keys, key)
+        self.data[key] = value
+
+    def write(self, records):
+        # Appends the records and flushes them to the OS before the store changes
+        if records:
+            self.log.write(''.join(json.dumps(record) + '\n' for record in records))
+            self.log.flush()
+
+    def replay(self):
+        """Rebuilds the data store from the append-only log"""
+        self.log.seek(0)
+        size = 0
+        for line in self.log.read().splitlines(keepends=True):
+            # A record is complete once its newline is written, anything else is the tail of a write cut
+            # short by a crash, which was never acknowledged
+            if not line.endswith('\n'):
+                break
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            size += len(line)
+            if record[0] == 'put':
+                self.data[record[1]] = record[2]
+            else:
+                self.data.pop(record[1], None)
+        # Records are ASCII JSON, so characters are bytes; new records must not be appended to a torn one
+        self.log.truncate(size)
+        self.log.seek(size)
+        self.keys = sorted(self.data)
+        print(f"Node {self.id} replayed {len(self.data)} items")
 
 
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('id', type=int)
+    parser.add_argument('--replicas', type=int, default=REPLICAS, help='copies of every item')
+    parser.add_argument('--log-dir', default=LOG_DIR, help='directory of the append-only log')
     args = parser.parse_args()
-    node = Node(args.id)
-    server = SimpleXMLRPCServer(('localhost', PORT + args.id))
+    if args.replicas < 1:
+        parser.error('--replicas must be at least 1')
+    node = Node(args.id, args.replicas, args.log_dir)
+    server = ThreadingXMLRPCServer(('localhost', PORT + args.id))
     server.register_instance(node)
     print(f"Starting server for node {args.id} on port {PORT + args.id}")
     server_thread = Thread(target=server.serve_forever)
     server_thread.start()
+    node.join()